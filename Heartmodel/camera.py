@@ -1,10 +1,12 @@
 import glm
 import pygame as pg
 
+from timestep import SIM_HZ
+
 FOV = 50  # field of view: degrees
 NEAR = 0.1
 FAR = 100
-SPEED = 0.005 #movement speed
+SPEED = 0.005 #movement speed (per ms)
 
 #camera position and movement
 class Camera:
@@ -24,23 +26,35 @@ class Camera:
         
         # guardar la posició del zoom
         self.zoom = glm.vec3((0,0,0))
+        self.prev_zoom = glm.vec3((0,0,0)) #zoom del pas de simulacio anterior, per interpolar
         self.right = glm.vec3((1, 0, 0))
         
         #for smooth velocity and movement
         self.zoom_velocity = glm.vec3((0, 0, 0))  # smooth movement
-        self.zoom_friction = 0.97 #friction
+        self.zoom_friction = 0.97 #friction (per pas de 1/60 s)
     
-    #update camera position
+    #update camera position (amb el zoom interpolat entre els dos ultims passos de simulacio)
     def update(self, position, up, forward):
-        self.position = glm.vec3(position) + self.zoom
+        self.position = glm.vec3(position) + glm.mix(self.prev_zoom, self.zoom, self.app.alpha)
         self.up = glm.vec3(up)
         self.forward = glm.vec3(forward)
         self.m_view = self.get_view_matrix()
         self.m_proj = self.get_projection_matrix()
     
-    #canviar camera basat en keys
-    def move(self):
-        velocity = SPEED * self.app.delta_time
+    #canviar camera basat en keys: un pas de simulacio de dt segons
+    def move(self, dt):
+        self.prev_zoom = glm.vec3(self.zoom)
+        steps = dt * SIM_HZ
+        #headless: sense teclat
+        if not self.app.headless:
+            self.move_keys(SPEED * dt * 1000)
+            
+        #apply zoom velocity for gesture-based zooming:
+        self.zoom += self.zoom_velocity * steps
+        self.zoom_velocity *= self.zoom_friction ** steps
+    
+    #moure la camera amb el teclat (a, d, q, e; r per reset)
+    def move_keys(self, velocity):
         keys = pg.key.get_pressed()
         if keys[pg.K_a]:
             self.zoom -= self.right * velocity
@@ -51,12 +65,7 @@ class Camera:
         if keys[pg.K_e]:
             self.zoom -= self.up * velocity
         if keys[pg.K_r]:
-            self.zoom = glm.vec3((0,0,0))
-            self.zoom_velocity = glm.vec3((0, 0, 0))
-            
-        #apply zoom velocity for gesture-based zooming:
-        self.zoom += self.zoom_velocity
-        self.zoom_velocity *= self.zoom_friction
+            self.reset_position()
     
     #zoom in per gesture input
     def move_forward(self):
@@ -69,6 +78,7 @@ class Camera:
     #reset position per gesture
     def reset_position(self):
         self.zoom = glm.vec3((0,0,0))
+        self.prev_zoom = glm.vec3((0,0,0)) #salt: sense interpolar
         self.zoom_velocity = glm.vec3((0, 0, 0))
         
     def get_view_matrix(self):
@@ -0,0 +1,120 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+from .onnx_models import EXECUTION_MODES, GRAPH_OPTIMIZATION_LEVELS, HandClassification, HandDetection, SessionConfig
+
+
+def benchmark(args, config, frame, boxes):
+    """
+    Time detector + classifier inference of one frame with a session configuration
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command line arguments (models, warmup and runs)
+    config : SessionConfig
+        Configuration to benchmark
+    frame : np.ndarray
+        Frame to run on
+    boxes : np.ndarray
+        Hand boxes to classify on the frame
+
+    Returns
+    -------
+    np.ndarray
+        Per-frame times in ms
+    """
+    detector = HandDetection(args.detector, session_config=config)
+    classifier = HandClassification(args.classifier, session_config=config)
+    times = np.empty(args.runs)
+    for i in range(args.warmup + args.runs):
+        start = time.perf_counter()
+        detector(frame)
+        classifier(frame, boxes)
+        if i >= args.warmup:
+            times[i - args.warmup] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def configurations(args):
+    cpus = os.cpu_count() or 1
+    threads = sorted({t for t in (1, 2, 4, cpus // 2, cpus) if 0 < t <= cpus}) if args.threads is None else args.threads
+    for intra, mode, level, mem_pattern in itertools.product(
+        threads, EXECUTION_MODES, args.graph_optimization, (False, True)
+    ):
+        yield SessionConfig(
+            intra_op_threads=intra,
+            inter_op_threads=args.inter_op_threads if mode == "parallel" else 0,
+            graph_optimization=level,
+            mem_pattern=mem_pattern,
+            execution_mode=mode,
+        )
+
+
+def flags(config):
+    result = [
+        f"--intra-op-threads {config.intra_op_threads}",
+        f"--graph-optimization {config.graph_optimization}",
+        f"--execution-mode {config.execution_mode}",
+    ]
+    if config.inter_op_threads:
+        result.append(f"--inter-op-threads {config.inter_op_threads}")
+    if config.mem_pattern:
+        result.append("--mem-pattern")
+    return " ".join(result)
+
+
+#benchmark session configurations on this host and print the flags of the fastest one
+def run(args):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    #two hands: the usual case (zoom gesture) for the classifier batch
+    boxes = np.array(
+        [
+            [args.width // 8, args.height // 4, args.width // 8 + 250, args.height // 4 + 300],
+            [args.width // 2, args.height // 4, args.width // 2 + 250, args.height // 4 + 300],
+        ]
+    )
+    results = []
+    for config in configurations(args):
+        times = benchmark(args, config, frame, boxes)
+        results.append((np.median(times), np.percentile(times, 95), config))
+        print(f"{np.median(times):8.2f} ms  p95 {np.percentile(times, 95):8.2f} ms  {flags(config)}")
+
+    results.sort(key=lambda result: result[0])
+    print("\nFastest configurations:")
+    for median, p95, config in results[:5]:
+        print(f"{median:8.2f} ms  p95 {p95:8.2f} ms  {flags(config)}")
+    print(f"\nRun the demo with: {flags(results[0][2])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ONNX Runtime session configurations on this host")
+    parser.add_argument(
+        "--detector", default="dynamic_gestures/models/hand_detector.onnx", type=str, help="Path to detector onnx model"
+    )
+    parser.add_argument(
+        "--classifier",
+        default="dynamic_gestures/models/crops_classifier.onnx",
+        type=str,
+        help="Path to classifier onnx model",
+    )
+    parser.add_argument("--threads", nargs="+", type=int, default=None, help="intra-op thread counts to try")
+    parser.add_argument("--inter-op-threads", default=2, type=int, help="inter-op threads for parallel execution mode")
+    parser.add_argument(
+        "--graph-optimization",
+        nargs="+",
+        default=["basic", "extended", "all"],
+        choices=list(GRAPH_OPTIMIZATION_LEVELS),
+        help="Graph optimization levels to try",
+    )
+    parser.add_argument("--width", default=1280, type=int, help="Frame width")
+    parser.add_argument("--height", default=720, type=int, help="Frame height")
+    parser.add_argument("--warmup", default=10, type=int, help="Untimed frames per configuration")
+    parser.add_argument("--runs", default=50, type=int, help="Timed frames per configuration")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,117 @@
+import threading
+
+import cv2
+import numpy as np
+
+from .utils.box_utils_numpy import iou_matrix
+
+
+#reuses the label of a hand whose crop barely changed since it was classified (held poses: stop, little finger...)
+class ClassificationCache:
+    def __init__(self, classification_model, max_reuse=5, iou_threshold=0.85, max_difference=0.04, thumbnail_size=16):
+        """
+        Classification cache following each hand from frame to frame
+
+        Parameters
+        ----------
+        classification_model : HandClassification
+            Model run on the cache misses
+
+        max_reuse : int
+            Consecutive frames a cached label may be reused before the hand is classified again
+
+        iou_threshold : float
+            Minimum IoU between the box and the box of the previous frame to reuse its label
+
+        max_difference : float
+            Maximum mean absolute difference (0-1) between the grayscale thumbnails of the crop and
+            of the crop that was classified
+
+        thumbnail_size : int
+            Side of the grayscale thumbnails compared
+        """
+        self.classification_model = classification_model
+        self.max_reuse = max_reuse
+        self.iou_threshold = iou_threshold
+        self.max_difference = max_difference
+        self.thumbnail_size = thumbnail_size
+        #one entry per hand of the previous call, held under lock
+        self.lock = threading.Lock()
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.thumbnails = np.empty((0, thumbnail_size, thumbnail_size), dtype=np.float32)
+        self.labels = np.empty(0, dtype=object)
+        self.reused = np.empty(0, dtype=np.int32)
+        self.hits = 0
+        self.misses = 0
+
+    def get_thumbnails(self, frame, bboxes):
+        size = (self.thumbnail_size, self.thumbnail_size)
+        thumbnails = np.full((len(bboxes),) + size, -1.0, dtype=np.float32)
+        #same square crops the classifier sees
+        for i, crop in enumerate(self.classification_model.get_crops(frame, bboxes)):
+            if crop is not None:
+                small = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+                thumbnails[i] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) / 255.0
+        return thumbnails
+
+    def __call__(self, frame, bboxes):
+        """
+        Labels of the boxes, from the cache or from the classifier. Call it once per frame, in frame
+        order, even without boxes: the boxes are matched against those of the previous call
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            Frame the boxes are on
+        bboxes : np.ndarray
+            Hand boxes
+
+        Returns
+        -------
+        np.ndarray
+            Labels, as HandClassification returns them
+        """
+        with self.lock:
+            boxes = np.asarray(bboxes, dtype=np.float32)
+            thumbnails = self.get_thumbnails(frame, bboxes)
+            source = np.full(len(boxes), -1) #cache entry reused by each box, -1 on a miss
+            if len(boxes) and len(self.boxes):
+                ious = iou_matrix(boxes, self.boxes)
+                for i in np.argsort(-ious.max(axis=1)):
+                    j = int(np.argmax(ious[i]))
+                    if (
+                        ious[i, j] >= self.iou_threshold
+                        and self.reused[j] < self.max_reuse
+                        and thumbnails[i, 0, 0] >= 0
+                        and np.abs(thumbnails[i] - self.thumbnails[j]).mean() <= self.max_difference
+                        and j not in source
+                    ):
+                        source[i] = j
+            hit = source >= 0
+            labels = np.full(len(boxes), None, dtype=object)
+            labels[hit] = self.labels[source[hit]]
+            if not hit.all():
+                labels[~hit] = list(self.classification_model(frame, bboxes[~hit]))
+            self.hits += int(hit.sum())
+            self.misses += int((~hit).sum())
+
+            #hits keep the thumbnail they were classified with, so slow drift still ends in a miss
+            thumbnails[hit] = self.thumbnails[source[hit]]
+            reused = np.zeros(len(boxes), dtype=np.int32)
+            reused[hit] = self.reused[source[hit]] + 1
+            self.boxes, self.thumbnails, self.labels, self.reused = boxes, thumbnails, labels, reused
+            if any(label is None for label in labels):
+                return labels
+            return labels.astype(np.int64)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+            hits, misses and hit rate since the cache was created
+        """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
@@ -0,0 +1,119 @@
+import numpy as np
+
+from .utils import MotionDetector
+
+
+#decides on which frames the full-frame detector runs, the Kalman tracks predict the hands in between
+class DetectionScheduler:
+    def __init__(
+        self,
+        max_interval=4,
+        max_drift=0.1,
+        max_uncertainty=0.1,
+        motion_threshold=0.01,
+        motion_size=(80, 45),
+        pixel_threshold=25,
+    ):
+        """
+        Detection scheduling from tracker confidence, hand velocity and frame motion
+
+        Parameters
+        ----------
+        max_interval : int
+            Maximum number of frames between two detections
+
+        max_drift : float
+            Displacement, as a fraction of the box width, a hand may move between two detections.
+            The interval is the number of frames the fastest tracked hand needs to move that far
+
+        max_uncertainty : float
+            Kalman position standard deviation, as a fraction of the box width, that forces a detection
+
+        motion_threshold : float
+            Fraction of changed pixels outside the tracked boxes that forces a detection (a hand coming in)
+
+        motion_size : tuple
+            (width, height) of the downscaled grayscale frames compared for motion
+
+        pixel_threshold : int
+            Gray level change that counts a downscaled pixel as changed
+        """
+        self.max_interval = max_interval
+        self.max_drift = max_drift
+        self.max_uncertainty = max_uncertainty
+        self.motion_threshold = motion_threshold
+        self.motion = MotionDetector(motion_size, pixel_threshold)
+        self.interval = 1
+        self.frames_since_detection = 0
+        self.detected = 0
+        self.skipped = 0
+
+    def should_detect(self, frame, tracks, min_hits):
+        """
+        Decide if the detector runs on this frame
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            BGR frame
+
+        tracks : list
+            MainController tracks
+
+        min_hits : int
+            Hits for a track to be confirmed
+
+        Returns
+        -------
+        bool
+            False when every hand can be predicted by its track
+        """
+        active = [trk["tracker"] for trk in tracks if trk["tracker"].time_since_update < 1]
+        boxes = []
+        confident = len(active) > 0
+        for tracker in active:
+            box = tracker.get_state()[0]
+            width = box[2] - box[0]
+            std = np.sqrt(max(tracker.kf.P[0, 0], tracker.kf.P[1, 1]))
+            #new tracks are confirmed by detections, and a prediction that drifted too much needs one
+            if (
+                tracker.hit_streak < min_hits
+                or not np.all(np.isfinite(box))
+                or width <= 0
+                or std > self.max_uncertainty * width
+            ):
+                confident = False
+            else:
+                boxes.append(box)
+        #motion is measured every frame, so the previous frame is always the last one
+        moved = self.motion(frame, boxes) > self.motion_threshold
+        self.frames_since_detection += 1
+        if not confident or moved or self.frames_since_detection >= self.interval:
+            self.frames_since_detection = 0
+            self.detected += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def update_interval(self, tracks):
+        """
+        Adapt the detection interval to the fastest tracked hand, after a detection
+
+        Parameters
+        ----------
+        tracks : list
+            MainController tracks
+        """
+        speed = 0.0
+        for trk in tracks:
+            tracker = trk["tracker"]
+            if tracker.time_since_update < 1:
+                box = tracker.get_state()[0]
+                width = box[2] - box[0]
+                if width > 0:
+                    #centre velocity of the Kalman state, in box widths per frame
+                    speed = max(speed, np.hypot(tracker.kf.x[4, 0], tracker.kf.x[5, 0]) / width)
+        if speed > 0:
+            self.interval = int(np.clip(self.max_drift / speed, 1, self.max_interval))
+        else:
+            self.interval = self.max_interval
@@ -0,0 +1,92 @@
+import time
+
+from .utils import MotionDetector
+
+
+#in front of MainController: no detection on a static empty scene, lower capture rate when nobody is around
+class IdleScheduler:
+    def __init__(
+        self,
+        idle_after=30.0,
+        idle_fps=5.0,
+        recheck_interval=1.0,
+        motion_threshold=0.005,
+        motion_size=(64, 36),
+        pixel_threshold=25,
+    ):
+        """
+        Motion gating and duty cycling of the gesture pipeline
+
+        Parameters
+        ----------
+        idle_after : float
+            Seconds without motion or tracks after which the pipeline goes idle
+
+        idle_fps : float
+            Capture and detection rate while idle
+
+        recheck_interval : float
+            Seconds between detections on a static scene without tracks, for a hand that came in
+            and stayed still
+
+        motion_threshold : float
+            Fraction of changed pixels that counts as motion
+
+        motion_size : tuple
+            (width, height) of the downscaled grayscale frames compared for motion
+
+        pixel_threshold : int
+            Gray level change that counts a downscaled pixel as changed
+        """
+        self.idle_after = idle_after
+        self.idle_fps = idle_fps
+        self.recheck_interval = recheck_interval
+        self.motion_threshold = motion_threshold
+        self.motion = MotionDetector(motion_size, pixel_threshold)
+        self.last_activity = time.perf_counter()
+        self.last_detection = float("-inf")
+        self.idle = False
+        self.detected = 0
+        self.skipped = 0
+
+    def should_detect(self, frame, tracking):
+        """
+        Decide if the detector runs on this frame
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            BGR frame
+
+        tracking : bool
+            MainController has tracks, they need detections even if the hands hold still
+
+        Returns
+        -------
+        bool
+        """
+        now = time.perf_counter()
+        moved = self.motion(frame) > self.motion_threshold
+        if moved or tracking:
+            self.last_activity = now
+        self.idle = now - self.last_activity > self.idle_after
+        if moved or tracking or now - self.last_detection >= self.recheck_interval:
+            self.last_detection = now
+            self.detected += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def activity(self):
+        """
+        A detection found hands: back to the full rate
+        """
+        self.last_activity = time.perf_counter()
+        self.idle = False
+
+    @property
+    def frame_interval(self):
+        """
+        Minimum seconds between captured frames, 0 at full rate
+        """
+        return 1.0 / self.idle_fps if self.idle else 0.0
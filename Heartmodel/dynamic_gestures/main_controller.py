@@ -1,16 +1,26 @@
+import os
+import threading
+
 import numpy as np
 
 from .ocsort import (
+    BatchKalmanFilter,
     KalmanBoxTracker,
+    assign,
     associate,
+    box_model,
     ciou_batch,
     ct_dist,
     diou_batch,
     giou_batch,
     iou_batch,
-    linear_assignment,
+    coast_trackers,
+    predict_trackers,
+    update_trackers,
 )
-from .onnx_models import HandClassification, HandDetection
+from .classification_cache import ClassificationCache
+from .detection_scheduler import DetectionScheduler
+from .onnx_models import HandClassification, HandDetection, model_variant_path
 from .utils import Deque, Drawer, Hand
 
 ASSO_FUNCS = {"iou": iou_batch, "giou": giou_batch, "ciou": ciou_batch, "diou": diou_batch, "ct_dist": ct_dist}
@@ -19,12 +29,7 @@ ASSO_FUNCS = {"iou": iou_batch, "giou": giou_batch, "ciou": ciou_batch, "diou":
 def k_previous_obs(observations, cur_age, k):
     if len(observations) == 0:
         return [-1, -1, -1, -1, -1]
-    for i in range(k):
-        dt = k - i
-        if cur_age - dt in observations:
-            return observations[cur_age - dt]
-    max_age = max(observations.keys())
-    return observations[max_age]
+    return observations.k_previous(cur_age, k)
 
 #handles detection, tracking and classification
 class MainController:
@@ -34,7 +39,22 @@ class MainController:
     """
 
     def __init__(
-        self, detection_model, classification_model, max_age=30, min_hits=3, iou_threshold=0.3, maxlen=30, min_frames=20
+        self,
+        detection_model,
+        classification_model,
+        max_age=30,
+        min_hits=3,
+        iou_threshold=0.3,
+        maxlen=30,
+        min_frames=20,
+        fuse_preprocess=False,
+        detection_threshold=0.7,
+        nms_threshold=0.3,
+        max_hands=4,
+        session_config=None,
+        model_variant="float",
+        detection_interval=1,
+        max_label_reuse=0,
     ):
         """
         Parameters
@@ -53,6 +73,24 @@ class MainController:
             Maximum length of deque in track.
         min_frames : int
             Minimum number of frames to confirm track.
+        fuse_preprocess : bool
+            Run the channel swap and normalization inside the ONNX graphs.
+        detection_threshold : float
+            Minimum detection score.
+        nms_threshold : float
+            IOU threshold for detection NMS.
+        max_hands : int
+            Maximum number of detections classified and tracked per frame, highest scores first.
+        session_config : SessionConfig
+            ONNX Runtime session tuning for both models.
+        model_variant : str
+            float, or int8 for the quantized models made by dynamic_gestures.quantize.
+        detection_interval : int
+            Maximum frames between two detections. Above 1 the detector is skipped while the tracks
+            predict the hands well, and only the classifier runs on the predicted boxes.
+        max_label_reuse : int
+            Above 0, a hand whose box and crop barely changed reuses its label for up to this many
+            frames instead of being classified again (ClassificationCache).
         """
         self.maxlen = maxlen
         self.min_frames = min_frames
@@ -63,9 +101,34 @@ class MainController:
         self.inertia = 0.2
         self.asso_func = ASSO_FUNCS["giou"]
         self.tracks = []
+        #Kalman states and covariances of all the tracks, stacked so predict/update run batched
+        self.kalman_bank = BatchKalmanFilter(*box_model())
         self.frame_count = 0
-        self.detection_model = HandDetection(detection_model)
-        self.classification_model = HandClassification(classification_model)
+        #held while update() changes self.tracks, readers of the tracks take it too when a PipelinedController runs update() on its own thread
+        self.lock = threading.RLock()
+        detection_model = model_variant_path(detection_model, model_variant)
+        classification_model = model_variant_path(classification_model, model_variant)
+        for path in (detection_model, classification_model):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found, create it with: python -m dynamic_gestures.quantize quantize")
+        self.detection_model = HandDetection(
+            detection_model,
+            fuse_preprocess=fuse_preprocess,
+            score_threshold=detection_threshold,
+            iou_threshold=nms_threshold,
+            top_k=max_hands,
+            session_config=session_config,
+        )
+        self.classification_model = HandClassification(
+            classification_model, fuse_preprocess=fuse_preprocess, session_config=session_config
+        )
+        self.classification_cache = (
+            ClassificationCache(self.classification_model, max_label_reuse) if max_label_reuse > 0 else None
+        )
+        self.scheduler = DetectionScheduler(detection_interval) if detection_interval > 1 else None
+        #frames without detections age the lost tracks too, so coasted and empty frames treat them alike.
+        #PipelinedController also sets it with an IdleScheduler, whose gating needs lost tracks to expire
+        self.expire_lost_tracks = self.scheduler is not None
         self.drawer = Drawer()
 
     def update(self, dets=np.empty((0, 5)), labels=None):
@@ -87,27 +150,27 @@ class MainController:
         -----
         The number of objects returned may differ from the number of detections provided.
 
+        On frames without detections every track gets an empty Hand and survives any number of them,
+        unless expire_lost_tracks is set: then the tracks are predicted and miss the frame as on any
+        other frame, and are removed after max_age frames without a detection.
+
         """
-        if len(dets) == 0:
+        if len(dets) == 0 and not self.expire_lost_tracks:
             for trk in self.tracks:
                 trk["hands"].append(Hand(bbox=None, gesture=None))
-            return
+            return np.empty((0, 5)), np.empty((0, 1))
 
         self.frame_count += 1
 
         # get predicted locations from existing trackers.
         trks = np.zeros((len(self.tracks), 5))
-        to_del = []
         ret = []
         lbs = []
-        for t, trk in enumerate(trks):
-            pos = self.tracks[t]["tracker"].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
+        trks[:, :4] = predict_trackers([trk["tracker"] for trk in self.tracks])
+        to_del = np.flatnonzero(np.isnan(trks).any(axis=1))
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
-            self.tracks.pop(t)
+            self.remove_track(t)
 
         velocities = np.array(
             [
@@ -127,8 +190,8 @@ class MainController:
             dets, trks, self.iou_threshold, velocities, k_observations, self.inertia
         )
 
+        update_trackers([self.tracks[m[1]]["tracker"] for m in matched], dets[matched[:, 0]])
         for m in matched:
-            self.tracks[m[1]]["tracker"].update(dets[m[0], :])
             self.tracks[m[1]]["hands"].append(Hand(bbox=dets[m[0], :4], gesture=labels[m[0]]))
 
         """
@@ -138,29 +201,22 @@ class MainController:
             left_dets = dets[unmatched_dets]
             left_trks = last_boxes[unmatched_trks]
             iou_left = self.asso_func(left_dets, left_trks)
-            iou_left = np.array(iou_left)
-            if iou_left.max() > self.iou_threshold:
-                """
-                NOTE: by using a lower threshold, e.g., self.iou_threshold - 0.1, you may
-                get a higher performance especially on MOT17/MOT20 datasets. But we keep it
-                uniform here for simplicity
-                """
-                rematched_indices = linear_assignment(-iou_left)
-                to_remove_det_indices = []
-                to_remove_trk_indices = []
-                for m in rematched_indices:
-                    det_ind, trk_ind = unmatched_dets[m[0]], unmatched_trks[m[1]]
-                    if iou_left[m[0], m[1]] < self.iou_threshold:
-                        continue
-                    self.tracks[trk_ind]["tracker"].update(dets[det_ind, :])
-                    self.tracks[trk_ind]["hands"].append(Hand(bbox=dets[det_ind, :4], gesture=labels[det_ind]))
-                    to_remove_det_indices.append(det_ind)
-                    to_remove_trk_indices.append(trk_ind)
-                unmatched_dets = np.setdiff1d(unmatched_dets, np.array(to_remove_det_indices))
-                unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
+            """
+            NOTE: by using a lower threshold, e.g., self.iou_threshold - 0.1, you may
+            get a higher performance especially on MOT17/MOT20 datasets. But we keep it
+            uniform here for simplicity
+            """
+            rematched, left_unmatched_dets, left_unmatched_trks = assign(iou_left, self.iou_threshold)
+            rematched_dets = unmatched_dets[rematched[:, 0]]
+            rematched_trks = unmatched_trks[rematched[:, 1]]
+            update_trackers([self.tracks[t]["tracker"] for t in rematched_trks], dets[rematched_dets])
+            for det_ind, trk_ind in zip(rematched_dets, rematched_trks):
+                self.tracks[trk_ind]["hands"].append(Hand(bbox=dets[det_ind, :4], gesture=labels[det_ind]))
+            unmatched_dets = unmatched_dets[left_unmatched_dets]
+            unmatched_trks = unmatched_trks[left_unmatched_trks]
 
+        update_trackers([self.tracks[m]["tracker"] for m in unmatched_trks], None)
         for m in unmatched_trks:
-            self.tracks[m]["tracker"].update(None)
             self.tracks[m]["hands"].append(Hand(bbox=None, gesture=None))
 
         # create and initialise new trackers for unmatched detections
@@ -168,7 +224,7 @@ class MainController:
             self.tracks.append(
                 {
                     "hands": Deque(self.maxlen, self.min_frames),
-                    "tracker": KalmanBoxTracker(dets[i, :], delta_t=self.delta_t),
+                    "tracker": KalmanBoxTracker(dets[i, :], delta_t=self.delta_t, bank=self.kalman_bank),
                 }
             )
         i = len(self.tracks)
@@ -194,13 +250,18 @@ class MainController:
             i -= 1
             # remove dead tracklet
             if trk["tracker"].time_since_update > self.max_age:
-                self.tracks.pop(i)
+                self.remove_track(i)
         if len(ret) > 0:
             return np.concatenate(ret), lbs
         return np.empty((0, 5)), np.empty((0, 1))
 
-    def __call__(self, frame):
+    def remove_track(self, index):
+        self.kalman_bank.release(self.tracks.pop(index)["tracker"].kf.slot)
+
+    def detect(self, frame):
         """
+        Detection stage
+
         Parameters
         ----------
         frame : np.array
@@ -208,16 +269,134 @@ class MainController:
 
         Returns
         -------
-        list of np.array
+        tuple
+            (bboxes, probs) of the detected hands, (None, None) when the scheduler skips the detector
+            and the tracks predict the hands.
+        """
+        if self.scheduler is not None:
+            with self.lock:
+                if not self.scheduler.should_detect(frame, self.tracks, self.min_hits):
+                    return None, None
+        return self.detection_model(frame)
 
+    def classify(self, frame, bboxes):
+        """
+        Crop classification stage
 
+        Parameters
+        ----------
+        frame : np.array
+            Image frame the boxes were detected on.
+        bboxes : np.array
+            Detected boxes.
+
+        Returns
+        -------
+        np.array
+            Labels of the boxes, None when there are no boxes or the detector was skipped.
         """
-        bboxes, probs = self.detection_model(frame)
+        if bboxes is None:
+            return None
+        if self.classification_cache is not None:
+            #also called without boxes, so the cache never matches hands across a frame without them
+            labels = self.classification_cache(frame, bboxes)
+            return labels if len(bboxes) else None
         if len(bboxes):
-            labels = self.classification_model(frame, bboxes)
-            bboxes = np.concatenate((bboxes, np.expand_dims(probs, axis=1)), axis=1)
-            new_bboxes, labels = self.update(dets=bboxes, labels=labels)
-            return new_bboxes[:, :-1], new_bboxes[:, -1], labels
-        else:
-            self.update(np.empty((0, 5)), None)
+            return self.classification_model(frame, bboxes)
+        return None
+
+    def track(self, bboxes, probs, labels, frame):
+        """
+        Tracking stage, must be called once per frame in frame order
+
+        Parameters
+        ----------
+        bboxes : np.array
+            Detected boxes, None on frames the detector skipped.
+        probs : np.array
+            Detection scores.
+        labels : np.array
+            Labels from classify().
+        frame : np.array
+            Frame, the predicted boxes are classified on it when the detector was skipped.
+
+        Returns
+        -------
+        tuple
+            (bboxes, ids, labels) of the confirmed tracks, (None, None, None) without confirmed tracks.
+        """
+        with self.lock:
+            if bboxes is None:
+                return self.coast(frame)
+            if len(bboxes):
+                bboxes = np.concatenate((bboxes, np.expand_dims(probs, axis=1)), axis=1)
+                new_bboxes, labels = self.update(dets=bboxes, labels=labels)
+            else:
+                new_bboxes, labels = self.update(np.empty((0, 5)), None)
+            result = (new_bboxes[:, :-1], new_bboxes[:, -1], labels) if len(new_bboxes) else (None, None, None)
+            if self.scheduler is not None:
+                self.scheduler.update_interval(self.tracks)
+            return result
+
+    def coast(self, frame):
+        """
+        Tracking on a frame the detector skipped: tracks updated on the previous frame move to their
+        predicted box and the classifier runs on those boxes, the other tracks miss the frame.
+
+        Parameters
+        ----------
+        frame : np.array
+            Image frame with shape (H, W, 3).
+
+        Returns
+        -------
+        tuple
+            (bboxes, ids, labels) of the confirmed tracks, as track() returns them.
+        """
+        self.frame_count += 1
+        active = [i for i, trk in enumerate(self.tracks) if trk["tracker"].time_since_update < 1]
+        lost = [i for i, trk in enumerate(self.tracks) if trk["tracker"].time_since_update >= 1]
+        boxes = coast_trackers([self.tracks[i]["tracker"] for i in active])
+        # lost tracks miss the frame, as in update()
+        lost_boxes = predict_trackers([self.tracks[i]["tracker"] for i in lost])
+        update_trackers([self.tracks[i]["tracker"] for i in lost], None)
+        for i in lost:
+            self.tracks[i]["hands"].append(Hand(bbox=None, gesture=None))
+        # tracks whose prediction is NaN are removed, as in update()
+        to_del = {i for i, box in zip(active + lost, np.concatenate((boxes, lost_boxes))) if np.isnan(box).any()}
+        coasted = [(self.tracks[i], box) for i, box in zip(active, boxes) if i not in to_del]
+        for i in reversed(range(len(self.tracks))):
+            if i in to_del or self.tracks[i]["tracker"].time_since_update > self.max_age:
+                self.remove_track(i)
+
+        bboxes = np.array([box for _, box in coasted]).reshape(-1, 4)
+        labels = self.classify(frame, np.round(bboxes).astype(np.int32))
+        if not coasted:
             return None, None, None
+        ret = []
+        lbs = []
+        for (trk, box), label in zip(coasted, labels):
+            trk["hands"].append(Hand(bbox=box, gesture=label))
+            if trk["tracker"].hit_streak >= self.min_hits or self.frame_count <= self.min_hits:
+                ret.append(np.concatenate((box, [trk["tracker"].id + 1])))
+                lbs.append(label)
+        if len(ret) > 0:
+            ret = np.array(ret)
+            return ret[:, :-1], ret[:, -1], lbs
+        return None, None, None
+
+    def __call__(self, frame):
+        """
+        Parameters
+        ----------
+        frame : np.array
+            Image frame with shape (H, W, 3).
+
+        Returns
+        -------
+        list of np.array
+
+
+        """
+        bboxes, probs = self.detect(frame)
+        return self.track(bboxes, probs, self.classify(frame, bboxes), frame)
@@ -1,2 +1,3 @@
-from .association import associate, ciou_batch, ct_dist, diou_batch, giou_batch, iou_batch, linear_assignment
-from .kalmanboxtracker import KalmanBoxTracker
+from .association import assign, associate, ciou_batch, ct_dist, diou_batch, giou_batch, iou_batch, linear_assignment
+from .batch_kalman import BatchKalmanFilter
+from .kalmanboxtracker import KalmanBoxTracker, box_model, coast_trackers, predict_trackers, update_trackers
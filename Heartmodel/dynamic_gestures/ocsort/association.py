@@ -1,5 +1,18 @@
+from functools import lru_cache
+from itertools import permutations
+
 import numpy as np
 
+# the solver is resolved once: lap if installed, scipy otherwise
+try:
+    import lap
+except ImportError:
+    lap = None
+    from scipy.optimize import linear_sum_assignment
+
+# problems up to this size (the 1-4 hands usually in view) are solved by trying every assignment
+EXHAUSTIVE_MAX_SIZE = 4
+
 
 def iou_batch(bboxes1, bboxes2):
     """
@@ -262,9 +275,28 @@ def speed_direction_batch(dets, tracks):
     return dy, dx  # size: num_track x num_det
 
 
-def linear_assignment(cost_matrix):
+@lru_cache(maxsize=None)
+def assignments(num_rows, num_cols):
+    """
+    All the assignments of min(N, M) rows to distinct columns of an [N, M] matrix.
+    Returns
+    -------
+    flat_indices: numpy.ndarray
+        shape is [K, min(N, M)], the raveled matrix indices of each assignment
+    pairs: numpy.ndarray
+        shape is [K, min(N, M), 2], the (row, column) pairs of each assignment, by row
+    """
+    if num_rows <= num_cols:
+        pairs = [list(enumerate(cols)) for cols in permutations(range(num_cols), num_rows)]
+    else:
+        pairs = [sorted((i, j) for j, i in enumerate(rows)) for rows in permutations(range(num_rows), num_cols)]
+    pairs = np.array(pairs, dtype=int)
+    return pairs[:, :, 0] * num_cols + pairs[:, :, 1], pairs
+
+
+def exhaustive_assignment(cost_matrix):
     """
-    Solve the linear assignment problem using scipy.optimize.linear_sum_assignment.
+    Solve a small linear assignment problem by evaluating every assignment at once.
     Parameters
     ----------
     cost_matrix: numpy.ndarray
@@ -273,18 +305,75 @@ def linear_assignment(cost_matrix):
     Returns
     -------
     indices: numpy.ndarray
-        shape is [N, 2]
+        shape is [min(N, M), 2]
     """
-    try:
-        import lap
+    flat_indices, pairs = assignments(*cost_matrix.shape)
+    return pairs[cost_matrix.ravel()[flat_indices].sum(1).argmin()]
+
 
+def linear_assignment(cost_matrix):
+    """
+    Solve the linear assignment problem, exhaustively for small problems and with lap or
+    scipy.optimize.linear_sum_assignment otherwise.
+    Parameters
+    ----------
+    cost_matrix: numpy.ndarray
+        shape is [N, M]
+
+    Returns
+    -------
+    indices: numpy.ndarray
+        shape is [min(N, M), 2]
+    """
+    if min(cost_matrix.shape) == 0:
+        return np.empty((0, 2), dtype=int)
+    if max(cost_matrix.shape) <= EXHAUSTIVE_MAX_SIZE:
+        return exhaustive_assignment(cost_matrix)
+    if lap is not None:
         _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-        return np.array([[y[i], i] for i in x if i >= 0])  #
-    except ImportError:
-        from scipy.optimize import linear_sum_assignment
+        return np.array([[y[i], i] for i in x if i >= 0], dtype=int).reshape(-1, 2)
+    x, y = linear_sum_assignment(cost_matrix)
+    return np.stack((x, y), axis=1)
+
+
+def assign(score_matrix, threshold, cost_matrix=None):
+    """
+    Match the rows and columns of a score matrix, keeping the pairs that score at least threshold.
+    Parameters
+    ----------
+    score_matrix: numpy.ndarray
+        shape is [N, M], e.g. the IoUs between detections and trackers
+    threshold: float
+        minimum score of a match
+    cost_matrix: numpy.ndarray
+        shape is [N, M], minimized by the assignment. Default is -score_matrix
+
+    Returns
+    -------
+    matches: numpy.ndarray
+        shape is [K, 2]
+    unmatched_rows: numpy.ndarray
+    unmatched_cols: numpy.ndarray
+    """
+    num_rows, num_cols = score_matrix.shape
+    if min(score_matrix.shape) > 0:
+        a = score_matrix > threshold
+        if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+            matched_indices = np.argwhere(a)
+        elif not (score_matrix >= threshold).any():
+            matched_indices = np.empty((0, 2), dtype=int)
+        else:
+            matched_indices = linear_assignment(-score_matrix if cost_matrix is None else cost_matrix)
+    else:
+        matched_indices = np.empty((0, 2), dtype=int)
 
-        x, y = linear_sum_assignment(cost_matrix)
-        return np.array(list(zip(x, y)))
+    # filter out matched with low score
+    matches = matched_indices[score_matrix[matched_indices[:, 0], matched_indices[:, 1]] >= threshold]
+    row_matched = np.zeros(num_rows, dtype=bool)
+    row_matched[matches[:, 0]] = True
+    col_matched = np.zeros(num_cols, dtype=bool)
+    col_matched[matches[:, 1]] = True
+    return matches, np.flatnonzero(~row_matched), np.flatnonzero(~col_matched)
 
 
 def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
@@ -308,38 +397,7 @@ def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
 
     iou_matrix = iou_batch(detections, trackers)
 
-    if min(iou_matrix.shape) > 0:
-        a = (iou_matrix > iou_threshold).astype(np.int32)
-        if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-            matched_indices = np.stack(np.where(a), axis=1)
-        else:
-            matched_indices = linear_assignment(-iou_matrix)
-    else:
-        matched_indices = np.empty(shape=(0, 2))
-
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
-
-    # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
-
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    return assign(iou_matrix, iou_threshold)
 
 
 def associate(detections, trackers, iou_threshold, velocities, previous_obs, vdc_weight):
@@ -364,58 +422,23 @@ def associate(detections, trackers, iou_threshold, velocities, previous_obs, vdc
         return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty((0, 5), dtype=int)
 
     Y, X = speed_direction_batch(detections, previous_obs)
-    inertia_Y, inertia_X = velocities[:, 0], velocities[:, 1]
-    inertia_Y = np.repeat(inertia_Y[:, np.newaxis], Y.shape[1], axis=1)
-    inertia_X = np.repeat(inertia_X[:, np.newaxis], X.shape[1], axis=1)
-    diff_angle_cos = inertia_X * X + inertia_Y * Y
+    # track velocities and scores broadcast over the [M, N] and [N, M] matrices
+    diff_angle_cos = velocities[:, 1:2] * X + velocities[:, 0:1] * Y
     diff_angle_cos = np.clip(diff_angle_cos, a_min=-1, a_max=1)
     diff_angle = np.arccos(diff_angle_cos)
     diff_angle = (np.pi / 2.0 - np.abs(diff_angle)) / np.pi
 
-    valid_mask = np.ones(previous_obs.shape[0])
-    valid_mask[np.where(previous_obs[:, 4] < 0)] = 0
+    valid_mask = ~(previous_obs[:, 4:5] < 0)
 
     iou_matrix = iou_batch(detections, trackers)
-    scores = np.repeat(detections[:, -1][:, np.newaxis], trackers.shape[0], axis=1)
+    scores = detections[:, -1:]
     # iou_matrix = iou_matrix * scores # a trick sometiems works, we don't encourage this
-    valid_mask = np.repeat(valid_mask[:, np.newaxis], X.shape[1], axis=1)
 
     angle_diff_cost = (valid_mask * diff_angle) * vdc_weight
     angle_diff_cost = angle_diff_cost.T
     angle_diff_cost = angle_diff_cost * scores
 
-    if min(iou_matrix.shape) > 0:
-        a = (iou_matrix > iou_threshold).astype(np.int32)
-        if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-            matched_indices = np.stack(np.where(a), axis=1)
-        else:
-            matched_indices = linear_assignment(-(iou_matrix + angle_diff_cost))
-    else:
-        matched_indices = np.empty(shape=(0, 2))
-
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
-
-    # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
-
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    return assign(iou_matrix, iou_threshold, -(iou_matrix + angle_diff_cost))
 
 
 def associate_kitti(detections, trackers, det_cates, iou_threshold, velocities, previous_obs, vdc_weight):
@@ -467,45 +490,8 @@ def associate_kitti(detections, trackers, det_cates, iou_threshold, velocities,
     """
     With multiple categories, generate the cost for catgory mismatch
     """
-    num_dets = detections.shape[0]
-    num_trk = trackers.shape[0]
-    cate_matrix = np.zeros((num_dets, num_trk))
-    for i in range(num_dets):
-        for j in range(num_trk):
-            if det_cates[i] != trackers[j, 4]:
-                cate_matrix[i][j] = -1e6
+    cate_matrix = np.where(np.reshape(det_cates, (-1, 1)) != trackers[:, 4], -1e6, 0.0)
 
     cost_matrix = -iou_matrix - angle_diff_cost - cate_matrix
 
-    if min(iou_matrix.shape) > 0:
-        a = (iou_matrix > iou_threshold).astype(np.int32)
-        if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-            matched_indices = np.stack(np.where(a), axis=1)
-        else:
-            matched_indices = linear_assignment(cost_matrix)
-    else:
-        matched_indices = np.empty(shape=(0, 2))
-
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
-
-    # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
-
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    return assign(iou_matrix, iou_threshold, cost_matrix)
@@ -0,0 +1,201 @@
+import numpy as np
+
+
+def cho_solve_batch(L, B):
+    """
+    Solve S X = B for a stack of small SPD systems given their Cholesky factors S = L L^T,
+    as the two triangular systems L Y = B and L^T X = Y. The stacked solves run in one batched
+    LAPACK call each (scipy's solve_triangular loops over the stack in Python)
+
+    Parameters
+    ----------
+    L : np.ndarray
+        Lower Cholesky factors, sized [N, n, n]
+    B : np.ndarray
+        Right-hand sides, sized [N, n, m]
+
+    Returns
+    -------
+    np.ndarray
+        X, sized [N, n, m]
+    """
+    return np.linalg.solve(L.transpose(0, 2, 1), np.linalg.solve(L, B))
+
+
+class KalmanSlot(object):
+    """
+    One filter of a BatchKalmanFilter, with the single-filter interface of KalmanFilterNew
+    (x and P as (dim_x, 1) and (dim_x, dim_x) views, predict() and update(z))
+    """
+
+    def __init__(self, bank, slot):
+        self.bank = bank
+        self.slot = slot
+
+    @property
+    def x(self):
+        return self.bank.x[self.slot][:, None]
+
+    @property
+    def P(self):
+        return self.bank.P[self.slot]
+
+    def predict(self):
+        self.bank.predict([self.slot])
+
+    def update(self, z):
+        if z is None:
+            self.bank.update_missing([self.slot])
+        else:
+            self.bank.update([self.slot], np.reshape(z, (1, -1)))
+
+
+class BatchKalmanFilter(object):
+    """
+    Kalman filters of all the tracks sharing one linear model (F, H, Q, R), with states and covariances
+    stacked in (N, dim_x) and (N, dim_x, dim_x) arrays: predict and update of any set of tracks are a
+    few vectorized operations. H must select the first dim_z state variables, as in the box model.
+
+    Keeps OC-SORT's observation-centric re-update of KalmanFilterNew: the first missed update of an
+    observed filter freezes its state, and the next observation restores it and replays a linear
+    virtual trajectory between the last observation before the gap and the new one.
+    """
+
+    def __init__(self, F, H, Q, R, P0, capacity=8):
+        self.dim_x = F.shape[0]
+        self.dim_z = H.shape[0]
+        if not np.array_equal(H, np.eye(self.dim_z, self.dim_x)):
+            raise ValueError("H must select the first dim_z state variables")
+        self.F = np.asarray(F, dtype=float)
+        self.Q = np.asarray(Q, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.P0 = np.asarray(P0, dtype=float)
+        self.x = np.zeros((capacity, self.dim_x))
+        self.P = np.zeros((capacity, self.dim_x, self.dim_x))
+        self.free = list(reversed(range(capacity)))
+        self.observed = np.zeros(capacity, dtype=bool)
+        #last observation of each filter, its update index and the number of updates: all the re-update needs
+        self.last_obs = np.zeros((capacity, self.dim_z))
+        self.last_obs_index = np.full(capacity, -1, dtype=np.int64)
+        self.obs_count = np.zeros(capacity, dtype=np.int64)
+        self.saved = [None] * capacity #(x, P) frozen on the first missed update
+
+    def grow(self):
+        capacity = len(self.x)
+        self.x = np.concatenate((self.x, np.zeros_like(self.x)))
+        self.P = np.concatenate((self.P, np.zeros_like(self.P)))
+        self.observed = np.concatenate((self.observed, np.zeros(capacity, dtype=bool)))
+        self.last_obs = np.concatenate((self.last_obs, np.zeros_like(self.last_obs)))
+        self.last_obs_index = np.concatenate((self.last_obs_index, np.full(capacity, -1, dtype=np.int64)))
+        self.obs_count = np.concatenate((self.obs_count, np.zeros(capacity, dtype=np.int64)))
+        self.saved.extend([None] * capacity)
+        self.free = list(reversed(range(capacity, 2 * capacity))) + self.free
+
+    def add(self, z):
+        """
+        Start a filter at measurement z, with covariance P0
+
+        Returns
+        -------
+        KalmanSlot
+        """
+        if not self.free:
+            self.grow()
+        slot = self.free.pop()
+        self.x[slot] = 0.0
+        self.x[slot, : self.dim_z] = np.ravel(z)
+        self.P[slot] = self.P0
+        self.observed[slot] = False
+        self.last_obs_index[slot] = -1
+        self.obs_count[slot] = 0
+        self.saved[slot] = None
+        return KalmanSlot(self, slot)
+
+    def release(self, slot):
+        self.saved[slot] = None
+        self.free.append(slot)
+
+    def predict(self, slots):
+        """
+        x = Fx, P = FPF' + Q for the given slots
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        self.x[slots] = self.x[slots] @ self.F.T
+        self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+
+    def update_missing(self, slots):
+        """
+        Update without observation: observed filters are frozen for the re-update
+        """
+        for slot in slots:
+            self.obs_count[slot] += 1
+            if self.observed[slot]:
+                self.saved[slot] = (self.x[slot].copy(), self.P[slot].copy())
+            self.observed[slot] = False
+
+    def update(self, slots, Z):
+        """
+        Update the given slots with measurements Z, sized [len(slots), dim_z]
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        Z = np.asarray(Z, dtype=float).reshape(len(slots), self.dim_z)
+        for slot, z in zip(slots, Z):
+            if not self.observed[slot] and self.saved[slot] is not None:
+                self.reupdate(slot, z)
+            else:
+                self.obs_count[slot] += 1
+            self.observed[slot] = True
+            self.last_obs[slot] = z
+            self.last_obs_index[slot] = self.obs_count[slot] - 1
+        self.correct(slots, Z)
+
+    def correct(self, slots, Z):
+        #H selects the first dim_z variables: HPH' and PH' are slices of P
+        d = self.dim_z
+        x = self.x[slots]
+        P = self.P[slots]
+        PHT = P[:, :, :d]
+        S = P[:, :d, :d] + self.R
+        #K = PH'S^-1, solved from the Cholesky factors of S instead of inverting it
+        K = cho_solve_batch(np.linalg.cholesky(S), PHT.transpose(0, 2, 1)).transpose(0, 2, 1)
+        x += (K @ (Z - x[:, :d])[:, :, None])[:, :, 0]
+        #P = (I-KH)P(I-KH)' + KRK', with (I-KH)A = A - K(HA) and HA the first dim_z rows of A
+        A = P - K @ P[:, :d, :]
+        KT = K.transpose(0, 2, 1)
+        self.P[slots] = A - A[:, :, :d] @ KT + K @ self.R @ KT
+        self.x[slots] = x
+
+    def reupdate(self, slot, z):
+        """
+        Observation-centric re-update: restore the state frozen at the start of the gap and replay
+        the virtual trajectory from the last observation to z
+        """
+        x, P = self.saved[slot]
+        self.saved[slot] = None
+        self.x[slot] = x
+        self.P[slot] = P
+        #updates since the last observation, z included, all replaced by the virtual trajectory
+        gap = self.obs_count[slot] - self.last_obs_index[slot]
+        self.obs_count[slot] += 1
+        for i, box in enumerate(virtual_trajectory(self.last_obs[slot], z, gap)):
+            self.correct(np.array([slot]), box[None])
+            if i < gap - 1:
+                self.predict([slot])
+
+
+def virtual_trajectory(z1, z2, gap):
+    """
+    Constant velocity boxes between two [x, y, s, r] observations gap frames apart
+
+    Returns
+    -------
+    np.ndarray
+        The gap boxes after z1, the last one is z2, sized [gap, 4]
+    """
+    x1, y1, s1, r1 = np.ravel(z1)
+    x2, y2, s2, r2 = np.ravel(z2)
+    w1, h1 = np.sqrt(s1 * r1), np.sqrt(s1 / r1)
+    w2, h2 = np.sqrt(s2 * r2), np.sqrt(s2 / r2)
+    steps = np.arange(1, gap + 1)[:, None] / gap
+    x, y, w, h = (np.array([x1, y1, w1, h1]) + steps * np.array([x2 - x1, y2 - y1, w2 - w1, h2 - h1])).T
+    return np.stack((x, y, w * h, w / h), axis=1)
@@ -2,6 +2,9 @@ from __future__ import print_function
 
 import numpy as np
 
+from .batch_kalman import KalmanSlot
+from .observation_buffer import ObservationBuffer
+
 
 def convert_bbox_to_z(bbox):
     """
@@ -39,6 +42,57 @@ def convert_x_to_bbox(x, score=None):
         return np.array([x[0] - w / 2.0, x[1] - h / 2.0, x[0] + w / 2.0, x[1] + h / 2.0, score]).reshape((1, 5))
 
 
+def convert_bboxes_to_z(bboxes):
+    """
+    convert_bbox_to_z of [N, 4+] boxes, returns [N, 4]
+    """
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    return np.stack((bboxes[:, 0] + w / 2.0, bboxes[:, 1] + h / 2.0, w * h, w / (h + 1e-6)), axis=1)
+
+
+def convert_x_to_bboxes(x):
+    """
+    convert_x_to_bbox of [N, 7] states, returns [N, 4]
+    """
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    return np.stack((x[:, 0] - w / 2.0, x[:, 1] - h / 2.0, x[:, 0] + w / 2.0, x[:, 1] + h / 2.0), axis=1)
+
+
+def box_model():
+    """
+    Constant velocity model of the state [x, y, s, r, vx, vy, vs] observed as [x, y, s, r]
+
+    Returns
+    -------
+    tuple
+        F, H, Q, R and the initial covariance P0
+    """
+    F = np.array(
+        [
+            [1, 0, 0, 0, 1, 0, 0],
+            [0, 1, 0, 0, 0, 1, 0],
+            [0, 0, 1, 0, 0, 0, 1],
+            [0, 0, 0, 1, 0, 0, 0],
+            [0, 0, 0, 0, 1, 0, 0],
+            [0, 0, 0, 0, 0, 1, 0],
+            [0, 0, 0, 0, 0, 0, 1],
+        ]
+    )
+    H = np.array([[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0], [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]])
+
+    R = np.eye(4)
+    R[2:, 2:] *= 10.0
+    P0 = np.eye(7)
+    P0[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
+    P0 *= 10.0
+    Q = np.eye(7)
+    Q[-1, -1] *= 0.01
+    Q[4:, 4:] *= 0.01
+    return F, H, Q, R, P0
+
+
 class KalmanBoxTracker(object):
     """
     This class represents the internal state of individual tracked objects observed as bbox.
@@ -46,42 +100,32 @@ class KalmanBoxTracker(object):
 
     count = 0
 
-    def __init__(self, bbox, delta_t=3, orig=False):
+    def __init__(self, bbox, delta_t=3, orig=False, bank=None):
         """
         Initialises a tracker using initial bounding box.
 
+        bank : BatchKalmanFilter, the filter is stacked with the other tracks of the bank
         """
         # define constant velocity model
-        if not orig:
-            from .kalmanfilter import KalmanFilterNew as KalmanFilter
-
-            self.kf = KalmanFilter(dim_x=7, dim_z=4)
+        F, H, Q, R, P0 = box_model()
+        if bank is not None:
+            self.kf = bank.add(convert_bbox_to_z(bbox))
         else:
-            from filterpy.kalman import KalmanFilter
-
-            self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array(
-            [
-                [1, 0, 0, 0, 1, 0, 0],
-                [0, 1, 0, 0, 0, 1, 0],
-                [0, 0, 1, 0, 0, 0, 1],
-                [0, 0, 0, 1, 0, 0, 0],
-                [0, 0, 0, 0, 1, 0, 0],
-                [0, 0, 0, 0, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 1],
-            ]
-        )
-        self.kf.H = np.array(
-            [[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0], [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]]
-        )
-
-        self.kf.R[2:, 2:] *= 10.0
-        self.kf.P[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.0
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
+            if not orig:
+                from .kalmanfilter import KalmanFilterNew as KalmanFilter
+
+                self.kf = KalmanFilter(dim_x=7, dim_z=4)
+            else:
+                from filterpy.kalman import KalmanFilter
+
+                self.kf = KalmanFilter(dim_x=7, dim_z=4)
+            self.kf.F = F
+            self.kf.H = H
+            self.kf.R = R
+            self.kf.P = P0
+            self.kf.Q = Q
+            self.kf.x[:4] = convert_bbox_to_z(bbox)
+
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         KalmanBoxTracker.count += 1
@@ -95,8 +139,8 @@ class KalmanBoxTracker(object):
         fast and unified way, which you would see below k_observations = np.array([k_previous_obs(...]]), let's bear it for now.
         """
         self.last_observation = np.array([-1, -1, -1, -1, -1])  # placeholder
-        self.observations = dict()
-        self.history_observations = []
+        # only the last delta_t ages are read (velocity direction and k_previous_obs)
+        self.observations = ObservationBuffer(delta_t + 1)
         self.velocity = None
         self.delta_t = delta_t
 
@@ -105,36 +149,37 @@ class KalmanBoxTracker(object):
         Updates the state vector with observed bbox.
         """
         if bbox is not None:
-            if self.last_observation.sum() >= 0:  # no previous observation
-                previous_box = None
-                for i in range(self.delta_t):
-                    dt = self.delta_t - i
-                    if self.age - dt in self.observations:
-                        previous_box = self.observations[self.age - dt]
-                        break
-                if previous_box is None:
-                    previous_box = self.last_observation
-                """
-                  Estimate the track speed direction with observations Delta t steps away
-                """
-                self.velocity = speed_direction(previous_box, bbox)
-
-            """
-              Insert new observations. This is a ugly way to maintain both self.observations
-              and self.history_observations. Bear it for the moment.
-            """
-            self.last_observation = bbox
-            self.observations[self.age] = bbox
-            self.history_observations.append(bbox)
-
-            self.time_since_update = 0
-            self.history = []
-            self.hits += 1
-            self.hit_streak += 1
+            self.observe(bbox)
             self.kf.update(convert_bbox_to_z(bbox))
         else:
             self.kf.update(bbox)
 
+    def observe(self, bbox):
+        """
+        Track bookkeeping of an observed bbox, without the filter update.
+        """
+        if self.last_observation.sum() >= 0:  # no previous observation
+            previous_box = None
+            for i in range(self.delta_t):
+                dt = self.delta_t - i
+                if self.age - dt in self.observations:
+                    previous_box = self.observations[self.age - dt]
+                    break
+            if previous_box is None:
+                previous_box = self.last_observation
+            """
+              Estimate the track speed direction with observations Delta t steps away
+            """
+            self.velocity = speed_direction(previous_box, bbox)
+
+        self.last_observation = bbox
+        self.observations[self.age] = bbox
+
+        self.time_since_update = 0
+        self.history = []
+        self.hits += 1
+        self.hit_streak += 1
+
     def predict(self):
         """
         Advances the state vector and returns the predicted bounding box estimate.
@@ -143,15 +188,88 @@ class KalmanBoxTracker(object):
             self.kf.x[6] *= 0.0
 
         self.kf.predict()
+        self.advance(convert_x_to_bbox(self.kf.x))
+        return self.history[-1]
+
+    def advance(self, box):
+        """
+        Track bookkeeping of a predict step, box is the predicted [1, 4] bounding box.
+        """
         self.age += 1
         if self.time_since_update > 0:
             self.hit_streak = 0
         self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
-        return self.history[-1]
+        self.history.append(box)
 
     def get_state(self):
         """
         Returns the current bounding box estimate.
         """
         return convert_x_to_bbox(self.kf.x)
+
+
+def shared_bank(trackers):
+    banks = {tracker.kf.bank for tracker in trackers if isinstance(tracker.kf, KalmanSlot)}
+    if len(banks) == 1 and all(isinstance(tracker.kf, KalmanSlot) for tracker in trackers):
+        return banks.pop()
+    return None
+
+
+def predict_trackers(trackers):
+    """
+    KalmanBoxTracker.predict of several trackers, in a few vectorized operations when their
+    filters share a BatchKalmanFilter
+
+    Returns
+    -------
+    np.ndarray
+        Predicted boxes, sized [N, 4]
+    """
+    if not trackers:
+        return np.empty((0, 4))
+    bank = shared_bank(trackers)
+    if bank is None:
+        return np.concatenate([tracker.predict() for tracker in trackers])
+    slots = np.array([tracker.kf.slot for tracker in trackers])
+    x = bank.x[slots]
+    x[x[:, 6] + x[:, 2] <= 0, 6] = 0.0
+    bank.x[slots] = x
+    bank.predict(slots)
+    boxes = convert_x_to_bboxes(bank.x[slots])
+    for tracker, box in zip(trackers, boxes):
+        tracker.advance(box[None])
+    return boxes
+
+
+def update_trackers(trackers, bboxes):
+    """
+    KalmanBoxTracker.update of several trackers, in a few vectorized operations when their
+    filters share a BatchKalmanFilter. bboxes is None for trackers without observation
+    """
+    if not trackers:
+        return
+    bank = shared_bank(trackers)
+    if bank is None:
+        for i, tracker in enumerate(trackers):
+            tracker.update(None if bboxes is None else bboxes[i])
+        return
+    slots = [tracker.kf.slot for tracker in trackers]
+    if bboxes is None:
+        bank.update_missing(slots)
+        return
+    for tracker, bbox in zip(trackers, bboxes):
+        tracker.observe(bbox)
+    bank.update(slots, convert_bboxes_to_z(np.asarray(bboxes, dtype=float)))
+
+
+def coast_trackers(trackers):
+    """
+    Advance trackers on a frame the detector skipped and return their predicted boxes. The filters get no
+    observation, as on a miss, so the next detection re-updates them over the skipped frames. The tracks
+    are not counted as missed: the predictions stand in for the detections.
+    """
+    boxes = predict_trackers(trackers)
+    update_trackers(trackers, None)
+    for tracker in trackers:
+        tracker.time_since_update = 0
+    return boxes
@@ -52,6 +52,8 @@ from filterpy.common import pretty_str, reshape_z
 from filterpy.stats import logpdf
 from numpy import dot, eye, isscalar, shape, zeros
 
+from .batch_kalman import virtual_trajectory
+
 
 class KalmanFilterNew(object):
     """Implements a Kalman filter. 
@@ -182,8 +184,10 @@ class KalmanFilterNew(object):
         self._likelihood = sys.float_info.min
         self._mahalanobis = None
 
-        # keep all observations
-        self.history_obs = []
+        # the last observation and its update index, all the re-update needs of the history
+        self.last_obs = None
+        self.last_obs_index = -1
+        self.obs_count = 0
 
         self.inv = np.linalg.inv
 
@@ -233,54 +237,36 @@ class KalmanFilterNew(object):
 
     def freeze(self):
         """
-        Save the parameters before non-observation forward
+        Save the parameters before non-observation forward: the state, its
+        covariance and the index of the last observation, the replay
+        regenerates everything else
         """
-        self.attr_saved = deepcopy(self.__dict__)
+        self.attr_saved = (self.x.copy(), self.P.copy(), self.last_obs_index)
 
-    def unfreeze(self):
+    def unfreeze(self, z):
         if self.attr_saved is not None:
-            new_history = deepcopy(self.history_obs)
-            self.__dict__ = self.attr_saved
-            # self.history_obs = new_history
-            self.history_obs = self.history_obs[:-1]
-            occur = [int(d is None) for d in new_history]
-            indices = np.where(np.array(occur) == 0)[0]
-            index1 = indices[-2]
-            index2 = indices[-1]
-            box1 = new_history[index1]
-            x1, y1, s1, r1 = box1
-            w1 = np.sqrt(s1 * r1)
-            h1 = np.sqrt(s1 / r1)
-            box2 = new_history[index2]
-            x2, y2, s2, r2 = box2
-            w2 = np.sqrt(s2 * r2)
-            h2 = np.sqrt(s2 / r2)
-            time_gap = index2 - index1
-            dx = (x2 - x1) / time_gap
-            dy = (y2 - y1) / time_gap
-            dw = (w2 - w1) / time_gap
-            dh = (h2 - h1) / time_gap
-            for i in range(index2 - index1):
-                """
-                The default virtual trajectory generation is by linear
-                motion (constant speed hypothesis), you could modify this
-                part to implement your own.
-                """
-                x = x1 + (i + 1) * dx
-                y = y1 + (i + 1) * dy
-                w = w1 + (i + 1) * dw
-                h = h1 + (i + 1) * dh
-                s = w * h
-                r = w / float(h)
-                new_box = np.array([x, y, s, r]).reshape((4, 1))
+            self.x, self.P, index1 = self.attr_saved
+            self.attr_saved = None
+            # the updates since the last observation, z included, are replaced
+            # by the virtual trajectory, that counts them again
+            time_gap = self.obs_count - 1 - index1
+            self.obs_count = index1 + 1
+            self.observed = True
+            """
+            The default virtual trajectory generation is by linear
+            motion (constant speed hypothesis), you could modify
+            virtual_trajectory to implement your own.
+            """
+            boxes = virtual_trajectory(self.last_obs, z, time_gap)
+            for i, new_box in enumerate(boxes):
                 """
                     I still use predict-update loop here to refresh the parameters,
                     but this can be faster by directly modifying the internal parameters
                     as suggested in the paper. I keep this naive but slow way for
                     easy read and understanding
                 """
-                self.update(new_box)
-                if not i == (index2 - index1 - 1):
+                self.update(new_box.reshape((4, 1)))
+                if not i == (time_gap - 1):
                     self.predict()
 
     def update(self, z, R=None, H=None):
@@ -308,8 +294,8 @@ class KalmanFilterNew(object):
         self._likelihood = None
         self._mahalanobis = None
 
-        # append the observation
-        self.history_obs.append(z)
+        # count the update, the re-update replays the updates missed since the last observation
+        self.obs_count += 1
 
         if z is None:
             if self.observed:
@@ -330,8 +316,10 @@ class KalmanFilterNew(object):
             """
             Get observation, use online smoothing to re-update parameters
             """
-            self.unfreeze()
+            self.unfreeze(z)
         self.observed = True
+        self.last_obs = z
+        self.last_obs_index = self.obs_count - 1
 
         if R is None:
             R = self.R
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class ObservationBuffer(object):
+    """
+    Fixed-size ring buffer of the latest observations of a track, keyed by the age they were made at.
+    The observation of age a lives in slot a % capacity, so lookups are O(1) and with a capacity of
+    k + 1 the observations of the last k ages before the current one are always kept.
+    Supports the dict operations the tracker used: obs[age] = box, age in obs, obs[age], len(obs).
+    """
+
+    def __init__(self, capacity, dim=5):
+        self.ages = np.full(capacity, -1, dtype=np.int64)
+        self.boxes = np.zeros((capacity, dim))
+        self.latest_age = -1
+        self.count = 0
+
+    def __setitem__(self, age, box):
+        slot = age % len(self.ages)
+        self.ages[slot] = age
+        self.boxes[slot] = box
+        self.latest_age = max(self.latest_age, age)
+        self.count += 1
+
+    def __contains__(self, age):
+        return age >= 0 and self.ages[age % len(self.ages)] == age
+
+    def __getitem__(self, age):
+        if age not in self:
+            raise KeyError(age)
+        return self.boxes[age % len(self.ages)]
+
+    def __len__(self):
+        return min(self.count, len(self.ages))
+
+    def latest(self):
+        """
+        The most recent observation
+        """
+        return self[self.latest_age]
+
+    def k_previous(self, cur_age, k):
+        """
+        The oldest observation among the k ages before cur_age, or the most recent one if there is none
+        """
+        for dt in range(k, 0, -1):
+            if cur_age - dt in self:
+                return self[cur_age - dt]
+        return self.latest()
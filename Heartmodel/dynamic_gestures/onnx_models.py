@@ -4,11 +4,206 @@ import cv2
 import numpy as np
 import onnxruntime as ort
 import os
+import platform
+import re
+
+from .utils.box_utils_numpy import filter_detections
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {"sequential": ort.ExecutionMode.ORT_SEQUENTIAL, "parallel": ort.ExecutionMode.ORT_PARALLEL}
+#float: the bundled models. int8: static-quantized versions written next to them by dynamic_gestures.quantize
+MODEL_VARIANTS = ["float", "int8"]
+
+
+def model_variant_path(model_path, variant):
+    """
+    Path of a model variant, e.g. models/hand_detector.onnx -> models/hand_detector.int8.onnx
+    Parameters
+    ----------
+    model_path : str
+        Path to the float onnx model
+    variant : str
+        One of MODEL_VARIANTS
+    Returns
+    -------
+    str
+        Path to the variant
+    """
+    if variant == "float":
+        return model_path
+    root, ext = os.path.splitext(model_path)
+    return f"{root}.{variant}{ext}"
+
+
+class SessionConfig:
+    def __init__(
+        self,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        graph_optimization="all",
+        mem_pattern=False,
+        cpu_mem_arena=True,
+        execution_mode="sequential",
+        optimized_model_dir=None,
+    ):
+        """
+        ONNX Runtime session tuning shared by all models
+
+        Parameters
+        ----------
+        intra_op_threads : int
+            Threads used inside an operator, 0 lets ONNX Runtime choose
+        inter_op_threads : int
+            Threads used across operators in parallel execution mode, 0 lets ONNX Runtime choose
+        graph_optimization : str
+            Graph optimization level: disable, basic, extended or all
+        mem_pattern : bool
+            Enable memory pattern planning
+        cpu_mem_arena : bool
+            Enable the CPU memory arena
+        execution_mode : str
+            sequential or parallel
+        optimized_model_dir : str
+            Directory where the optimized graphs are saved. The graphs of the "all" level hold host and
+            execution provider specific operators, so they are keyed by provider, ONNX Runtime version
+            and host. A saved graph newer than its model is loaded with graph optimization disabled,
+            so later starts skip it
+        """
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        self.mem_pattern = mem_pattern
+        self.cpu_mem_arena = cpu_mem_arena
+        self.execution_mode = execution_mode
+        self.optimized_model_dir = optimized_model_dir
+
+    def session_options(self):
+        """
+        Returns
+        -------
+        onnxruntime.SessionOptions
+            Session options for this configuration
+        """
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+        options.enable_mem_pattern = self.mem_pattern
+        options.enable_cpu_mem_arena = self.cpu_mem_arena
+        options.execution_mode = EXECUTION_MODES[self.execution_mode]
+        return options
+
+    def optimized_model_path(self, model_path, variant="", provider="CPUExecutionProvider"):
+        """
+        Path of the saved optimized graph for a model, None if saving is disabled. The name holds the
+        level, the execution provider and a fingerprint of the ONNX Runtime version and of the host,
+        so a graph is never reused by another runtime or machine
+        """
+        if self.optimized_model_dir is None:
+            return None
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        fingerprint = re.sub(r"[^\w.-]", "_", f"ort{ort.__version__}-{platform.machine()}-{platform.node()}")
+        return os.path.join(
+            self.optimized_model_dir, f"{name}{variant}.{self.graph_optimization}.{provider}.{fingerprint}.onnx"
+        )
+
+    def create_session(self, model_path, model_source=None, variant=""):
+        """
+        Build the inference session of a model
+
+        Parameters
+        ----------
+        model_path : str
+            Path to onnx model
+        model_source : str or bytes
+            What to load, when it is not the file itself (e.g. a serialized modified graph)
+        variant : str
+            Suffix telling apart the saved optimized graphs of the same model
+
+        Returns
+        -------
+        onnxruntime.InferenceSession
+            Session
+        """
+        model_source = model_path if model_source is None else model_source
+        options, prov_opts, providers = OnnxModel.get_onnx_provider(session_config=self)
+        optimized_path = self.optimized_model_path(model_path, variant, providers[-1])
+        if optimized_path is not None:
+            if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+                #already optimized on this host and runtime: load it as is
+                model_source = optimized_path
+                options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable"]
+            else:
+                #this session optimizes the graph and saves it for the next starts
+                os.makedirs(self.optimized_model_dir, exist_ok=True)
+                options.optimized_model_filepath = optimized_path
+        return ort.InferenceSession(model_source, sess_options=options, providers=providers, provider_options=prov_opts)
+
+    @staticmethod
+    def add_arguments(parser):
+        """
+        Add the session tuning flags to an argparse parser
+        """
+        group = parser.add_argument_group("ONNX Runtime session")
+        group.add_argument("--intra-op-threads", default=0, type=int, help="Threads inside an operator (0: ORT default)")
+        group.add_argument("--inter-op-threads", default=0, type=int, help="Threads across operators (0: ORT default)")
+        group.add_argument(
+            "--graph-optimization", default="all", choices=list(GRAPH_OPTIMIZATION_LEVELS), help="Graph optimization level"
+        )
+        group.add_argument("--mem-pattern", action="store_true", help="Enable memory pattern planning")
+        group.add_argument("--no-cpu-mem-arena", action="store_true", help="Disable the CPU memory arena")
+        group.add_argument("--execution-mode", default="sequential", choices=list(EXECUTION_MODES), help="Execution mode")
+        group.add_argument(
+            "--optimized-model-dir", default=None, type=str, help="Save optimized graphs here and reuse them on later starts"
+        )
+        return parser
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build the configuration from the flags added by add_arguments
+        """
+        return cls(
+            intra_op_threads=args.intra_op_threads,
+            inter_op_threads=args.inter_op_threads,
+            graph_optimization=args.graph_optimization,
+            mem_pattern=args.mem_pattern,
+            cpu_mem_arena=not args.no_cpu_mem_arena,
+            execution_mode=args.execution_mode,
+            optimized_model_dir=args.optimized_model_dir,
+        )
+
+    def __repr__(self):
+        return (
+            f"SessionConfig(intra_op_threads={self.intra_op_threads}, inter_op_threads={self.inter_op_threads}, "
+            f"graph_optimization={self.graph_optimization}, mem_pattern={self.mem_pattern}, "
+            f"cpu_mem_arena={self.cpu_mem_arena}, execution_mode={self.execution_mode})"
+        )
+
 
 class OnnxModel(ABC):
-    def __init__(self, model_path, image_size):
+    def __init__(self, model_path, image_size, fuse_preprocess=False, session_config=None):
+        """
+        Parameters
+        ----------
+        model_path : str
+            Path to onnx model
+        image_size : tuple
+            Model input size (width, height)
+        fuse_preprocess : bool
+            Add the channel swap, normalization and NCHW transpose as prefix nodes of the ONNX graph.
+            The model then takes the resized BGR frame as uint8 NHWC
+        session_config : SessionConfig
+            ONNX Runtime session tuning, defaults to SessionConfig()
+        """
         self.model_path = model_path
         self.image_size = image_size
+        self.fuse_preprocess = fuse_preprocess
         
         #normalization parameters (input images)
         self.mean = np.array([127, 127, 127], dtype=np.float32)
@@ -17,30 +212,133 @@ class OnnxModel(ABC):
         #self.std = np.array([0.234, 0.235, 0.231], dtype=np.float32) * 255
         # > aixo era les meves nornamlitzacions customgestureclassifier
         #ONNX runtime with providers:
-        options, prov_opts, providers = self.get_onnx_provider()
-        self.sess = ort.InferenceSession(
-            model_path, sess_options=options, providers=providers, provider_options=prov_opts
+        self.session_config = SessionConfig() if session_config is None else session_config
+        self.model_source = self.add_preprocess_prefix(model_path) if fuse_preprocess else model_path
+        self.sess = self.session_config.create_session(
+            model_path, self.model_source, variant=".fused" if fuse_preprocess else ""
         )
         self._get_input_output()
+        self._allocate_buffers()
+        self.input_name = self.sess.get_inputs()[0].name
+        self.output_names = [output.name for output in self.sess.get_outputs()]
+        #inference through IOBinding: the input is read in place from the preallocated buffers
+        self.io_binding = self.sess.io_binding()
+        self.bound = {}
 
-    def preprocess(self, frame):
+    def bind(self, name, array, output=False):
         """
-        Preprocess frame. BGR -> RGB, resize, normalize and format for model input
+        Bind a preallocated array as a model input or output. Rebinding is skipped while
+        the array memory and shape stay the same
+        Parameters
+        ----------
+        name : str
+            Input or output name
+        array : np.ndarray
+            C-contiguous array, must stay alive while bound
+        output : bool
+            Bind as output instead of input
+        """
+        key = (array.ctypes.data, array.shape)
+        if self.bound.get(name) == key:
+            return
+        bind = self.io_binding.bind_output if output else self.io_binding.bind_input
+        bind(name, "cpu", 0, array.dtype, array.shape, array.ctypes.data)
+        self.bound[name] = key
+
+    def _allocate_buffers(self):
+        """
+        Preallocate the preprocessing buffers for the model input size, reused every frame
+        """
+        width, height = self.image_size
+        #resize target (BGR uint8) and its RGB CHW view: the channel swap and transpose are just strides
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.resized_rgb_chw = self.resized.transpose(2, 0, 1)[::-1]
+        self.mean_chw = self.mean.reshape(3, 1, 1)
+        self.inv_std_chw = (1.0 / self.std).reshape(3, 1, 1)
+        if self.fuse_preprocess:
+            self.input_buffer = np.empty((1, height, width, 3), dtype=np.uint8)
+        else:
+            self.input_buffer = np.empty((1, 3, height, width), dtype=np.float32)
+
+    def preprocess(self, frame, out=None):
+        """
+        Preprocess frame. BGR -> RGB, resize, normalize and format for model input,
+        written straight into a preallocated float32 NCHW buffer
         Parameters
         ----------
         frame : np.ndarray
             Frame to preprocess
+        out : np.ndarray
+            Buffer to write into, one sample of the model input: (3, H, W) float32,
+            or (H, W, 3) uint8 with fuse_preprocess. Defaults to the model's own input buffer
         Returns
         -------
         np.ndarray
-            Preprocessed frame
+            Preprocessed frame. Without out it is the model's input buffer, overwritten on the next call
+        """
+        if out is None:
+            out = self.input_buffer[0]
+            result = self.input_buffer
+        else:
+            result = out
+        if self.fuse_preprocess:
+            #the graph does the rest
+            cv2.resize(frame, self.image_size, dst=out)
+            return result
+        cv2.resize(frame, self.image_size, dst=self.resized)
+        #(rgb - mean) / std in float32, one pass over the strided view and one in place
+        np.subtract(self.resized_rgb_chw, self.mean_chw, out=out)
+        np.multiply(out, self.inv_std_chw, out=out)
+        return result
+
+    def add_preprocess_prefix(self, model_path):
+        """
+        Prepend the preprocessing to the ONNX graph: uint8 BGR NHWC -> float32 normalized RGB NCHW
+        Parameters
+        ----------
+        model_path : str
+            Path to onnx model
+        Returns
+        -------
+        bytes
+            Serialized model with a uint8 NHWC input of the same name
         """
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image = cv2.resize(image, self.image_size)
-        image = (image - self.mean) / self.std
-        image = np.transpose(image, [2, 0, 1])
-        image = np.expand_dims(image, axis=0)
-        return image
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+
+        model = onnx.load(model_path)
+        graph = model.graph
+        graph_input = graph.input[0]
+        name = graph_input.name
+        batch = graph_input.type.tensor_type.shape.dim[0]
+        batch = batch.dim_param or batch.dim_value
+        width, height = self.image_size
+
+        prefix = f"{name}_preprocess"
+        graph.initializer.extend(
+            [
+                numpy_helper.from_array(np.array([2, 1, 0], dtype=np.int64), f"{prefix}_rgb"),
+                numpy_helper.from_array(self.mean.reshape(1, 3, 1, 1), f"{prefix}_mean"),
+                numpy_helper.from_array((1.0 / self.std).reshape(1, 3, 1, 1), f"{prefix}_inv_std"),
+            ]
+        )
+        #the original input becomes an internal tensor fed by the prefix, the new input keeps its name
+        for node in graph.node:
+            for i, node_input in enumerate(node.input):
+                if node_input == name:
+                    node.input[i] = f"{prefix}_normalized"
+        nodes = [
+            helper.make_node("Cast", [name], [f"{prefix}_f32"], to=TensorProto.FLOAT),
+            helper.make_node("Transpose", [f"{prefix}_f32"], [f"{prefix}_chw"], perm=[0, 3, 1, 2]),
+            helper.make_node("Gather", [f"{prefix}_chw", f"{prefix}_rgb"], [f"{prefix}_rgb_chw"], axis=1),
+            helper.make_node("Sub", [f"{prefix}_rgb_chw", f"{prefix}_mean"], [f"{prefix}_centered"]),
+            helper.make_node("Mul", [f"{prefix}_centered", f"{prefix}_inv_std"], [f"{prefix}_normalized"]),
+        ]
+        for node in reversed(nodes):
+            graph.node.insert(0, node)
+        graph.input.remove(graph_input)
+        graph.input.insert(0, helper.make_tensor_value_info(name, TensorProto.UINT8, [batch, height, width, 3]))
+        return model.SerializeToString()
 
     def _get_input_output(self):
         inputs = self.sess.get_inputs()
@@ -60,9 +358,13 @@ class OnnxModel(ABC):
         )
 
     @staticmethod
-    def get_onnx_provider():
+    def get_onnx_provider(session_config=None):
         """
         Get onnx provider
+        Parameters
+        ----------
+        session_config : SessionConfig
+            Session tuning, defaults to SessionConfig()
         Returns
         -------
         options : onnxruntime.SessionOptions
@@ -73,9 +375,7 @@ class OnnxModel(ABC):
             List of providers
         """
         providers = ["CPUExecutionProvider"]
-        options = ort.SessionOptions()
-        options.enable_mem_pattern = False
-        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options = (SessionConfig() if session_config is None else session_config).session_options()
 
         if "DML" in ort.get_device():
             prov_opts = [{"device_id": 0}]
@@ -109,29 +409,83 @@ class OnnxModel(ABC):
         )
 
 class HandDetection(OnnxModel):
-    def __init__(self, model_path, image_size=(320, 240)):
-        super().__init__(model_path, image_size)
+    def __init__(
+        self,
+        model_path,
+        image_size=(320, 240),
+        fuse_preprocess=False,
+        score_threshold=0.7,
+        iou_threshold=0.3,
+        top_k=-1,
+        session_config=None,
+    ):
+        """
+        Parameters
+        ----------
+        score_threshold : float
+            Minimum detection score. The exported detector already drops scores <= 0.7 in the graph
+        iou_threshold : float
+            NMS IoU threshold
+        top_k : int
+            Maximum number of detections kept, highest scores first. If <= 0, keep all
+        """
+        super().__init__(model_path, image_size, fuse_preprocess, session_config)
         self.image_size = image_size
-        self.sess = ort.InferenceSession(model_path)
-        self.input_name = self.sess.get_inputs()[0].name
-        self.output_names = [output.name for output in self.sess.get_outputs()]
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.top_k = top_k
+        self.bind(self.input_name, self.input_buffer)
+        #the number of detections depends on the frame: ORT allocates the (small) outputs
+        for name in self.output_names:
+            self.io_binding.bind_output(name, "cpu")
+        self.box_scale = np.ones(4, dtype=np.float32)
+        self.frame_size = None
         
     def __call__(self, frame):
-        input_tensor = self.preprocess(frame)
-        boxes, _, probs = self.sess.run(self.output_names, {self.input_name: input_tensor})
-        width, height = frame.shape[1], frame.shape[0]
-        boxes[:, 0] *= width
-        boxes[:, 1] *= height
-        boxes[:, 2] *= width
-        boxes[:, 3] *= height
-        return boxes.astype(np.int32), probs
+        self.preprocess(frame)
+        self.sess.run_with_iobinding(self.io_binding)
+        boxes, _, probs = (value.numpy() for value in self.io_binding.get_outputs())
+        height, width = frame.shape[:2]
+        if self.frame_size != (width, height):
+            self.box_scale[:] = (width, height, width, height)
+            self.frame_size = (width, height)
+        #normalized -> pixel coordinates in one in-place pass
+        np.multiply(boxes, self.box_scale, out=boxes)
+        dets = filter_detections(boxes, probs, self.score_threshold, self.iou_threshold, self.top_k)
+        return dets[:, :4].astype(np.int32), dets[:, 4]
 
 
 class HandClassification(OnnxModel):
-    def __init__(self, model_path, image_size=(128, 128)): #Customgesture era: 224,224
-        super().__init__(model_path, image_size)
+    def __init__(
+        self, model_path, image_size=(128, 128), fuse_preprocess=False, max_batch=4, session_config=None
+    ): #Customgesture era: 224,224
+        super().__init__(model_path, image_size, fuse_preprocess, session_config)
+        #crop batch and logits reused every frame, grow if more hands than max_batch are in view
+        self.num_classes = self.sess.get_outputs()[0].shape[1]
+        self.allocate_batch(max_batch)
         #self.frame_count=0 #ADDED!!!
 
+    def allocate_batch(self, size):
+        self.batch = np.empty((size,) + self.input_buffer.shape[1:], dtype=self.input_buffer.dtype)
+        self.logits = np.empty((size, self.num_classes), dtype=np.float32)
+
+    def infer(self, n):
+        """
+        Run the model on the first n crops of the batch, output written into the preallocated logits
+        Parameters
+        ----------
+        n : int
+            Number of crops
+        Returns
+        -------
+        np.ndarray
+            Labels of the n crops
+        """
+        self.bind(self.input_name, self.batch[:n])
+        self.bind(self.output_names[0], self.logits[:n], output=True)
+        self.sess.run_with_iobinding(self.io_binding)
+        return np.argmax(self.logits[:n], axis=1)
+
     @staticmethod
     def get_square(box, image):
         """
@@ -143,20 +497,38 @@ class HandClassification(OnnxModel):
         image : np.ndarray
             Image for shape
         """
+        return tuple(HandClassification.get_squares(np.asarray(box)[None], image)[0])
+
+    @staticmethod
+    def get_squares(boxes, image):
+        """
+        Get square boxes from rectangular boxes, all at once
+        Parameters
+        ----------
+        boxes : np.ndarray
+            Boxes coordinates (N, 4) as (x1, y1, x2, y2)
+        image : np.ndarray
+            Image for shape
+        Returns
+        -------
+        np.ndarray
+            Square boxes (N, 4), clamped to the image
+        """
         height, width, _ = image.shape
-        x0, y0, x1, y1 = box
+        squares = np.array(boxes[:, :4], dtype=np.int64)
+        x0, y0, x1, y1 = squares.T
         w, h = x1 - x0, y1 - y0
-        if h < w:
-            y0 = y0 - int((w - h) / 2)
-            y1 = y0 + w
-        if h > w:
-            x0 = x0 - int((h - w) / 2)
-            x1 = x0 + h
-        x0 = max(0, x0)
-        y0 = max(0, y0)
-        x1 = min(width - 1, x1)
-        y1 = min(height - 1, y1)
-        return x0, y0, x1, y1
+        #grow the short side around the center (int() truncation as before)
+        wide, tall = h < w, h > w
+        y0[wide] -= ((w - h)[wide] / 2).astype(np.int64)
+        y1[wide] = y0[wide] + w[wide]
+        x0[tall] -= ((h - w)[tall] / 2).astype(np.int64)
+        x1[tall] = x0[tall] + h[tall]
+        np.maximum(x0, 0, out=x0)
+        np.maximum(y0, 0, out=y0)
+        np.minimum(x1, width - 1, out=x1)
+        np.minimum(y1, height - 1, out=y1)
+        return squares
 
     def get_crops(self, frame, bboxes):
         """
@@ -170,14 +542,12 @@ class HandClassification(OnnxModel):
 
         Returns
         -------
-        crops : np.ndarray
-            Crops from frame
+        crops : list
+            Crops from frame (views, no copy). Empty crops are None
         """
         crops = []
-        for bbox in bboxes:
-            bbox = self.get_square(bbox, frame)
-            crop = frame[bbox[1] : bbox[3], bbox[0] : bbox[2]]
-            crops.append(crop)
+        for x0, y0, x1, y1 in self.get_squares(np.asarray(bboxes), frame):
+            crops.append(frame[y0:y1, x0:x1] if x1 > x0 and y1 > y0 else None)
         return crops
 
     def __call__(self, image, bboxes):
@@ -193,11 +563,21 @@ class HandClassification(OnnxModel):
         Returns
         -------
         predictions : np.ndarray
-            Predictions from model
+            Predictions from model. Boxes whose square crop is empty after clamping to the
+            image are not classified and get None (the array is then dtype object)
         """
         crops = self.get_crops(image, bboxes)
-        crops = [self.preprocess(crop) for crop in crops]
-        input_name = self.sess.get_inputs()[0].name
-        outputs = self.sess.run(None, {input_name: np.concatenate(crops, axis=0)})[0]
-        labels = np.argmax(outputs, axis=1)
+        valid = [i for i, crop in enumerate(crops) if crop is not None]
+        if len(valid) > len(self.batch):
+            self.allocate_batch(len(valid))
+        #each crop is resized and normalized straight into its slot, one inference call for all of them
+        for slot, i in enumerate(valid):
+            self.preprocess(crops[i], out=self.batch[slot])
+        if len(valid) == len(crops):
+            if not valid:
+                return np.empty(0, dtype=np.int64)
+            return self.infer(len(valid))
+        labels = np.full(len(crops), None, dtype=object)
+        if valid:
+            labels[valid] = self.infer(len(valid))
         return labels
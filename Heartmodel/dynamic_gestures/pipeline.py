@@ -0,0 +1,240 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+#end of stream marker, flows down the stages after the last frame
+STOP = None
+#frames a track may go without detection and still keep the idle scheduler detecting on every frame
+TRACK_GRACE = 3
+
+
+#runs MainController stages on worker threads: capture -> detection -> crop classification -> tracking
+class PipelinedController:
+    def __init__(self, controller, grabber, queue_size=2, threaded=True, latency_window=120, idle_scheduler=None):
+        """
+        Pipelined gesture inference. ONNX Runtime releases the GIL during inference, so detection of
+        frame t+1 runs while frame t is classified and throughput approaches the slowest stage instead
+        of the sum of all of them.
+
+        Every stage is a single thread and stages are joined by bounded FIFO queues, so frames come out
+        in capture order and MainController.update still sees them in order. A full queue blocks the
+        stage before it, and the grabber drops stale frames instead of letting latency grow.
+
+        With a DetectionScheduler on the controller, classification and tracking share one stage: on
+        the frames the detector skips, the boxes classified are the track predictions, which are only
+        known once the previous frame is tracked. The classifier is then only ever run by that stage.
+
+        Parameters
+        ----------
+        controller : MainController
+            Controller whose detect, classify and track stages are run
+
+        grabber : FrameGrabber
+            Started frame source, its thread is the capture stage
+
+        queue_size : int
+            Frames held by each queue between stages
+
+        threaded : bool
+            False runs all the stages one after another on the thread calling read()
+
+        latency_window : int
+            Number of recent capture-to-result latencies kept for stats()
+
+        idle_scheduler : IdleScheduler
+            Skips the detector on a static scene without tracks and lowers the capture rate when idle
+        """
+        self.controller = controller
+        self.grabber = grabber
+        self.threaded = threaded
+        self.idle_scheduler = idle_scheduler
+        if idle_scheduler is not None:
+            #a hand that left must stop counting as tracked, so its track has to age out on the frames without hands
+            controller.expire_lost_tracks = True
+        self.detected = queue.Queue(maxsize=queue_size) #(frame, timestamp, bboxes, probs)
+        self.classified = queue.Queue(maxsize=queue_size) #(frame, timestamp, bboxes, probs, labels)
+        self.results = queue.Queue(maxsize=queue_size) #(frame, timestamp, (bboxes, ids, labels))
+        self.threads = []
+        self.running = False
+        self.finished = False
+        self.error = None
+        self.latencies = deque(maxlen=latency_window)
+
+    def start(self):
+        """
+        Start the stage threads
+
+        Returns
+        -------
+        PipelinedController
+            self, so it can be chained after the constructor
+        """
+        self.running = True
+        if self.threaded:
+            if self.controller.scheduler is not None:
+                stages = (("detection", self._detect), ("tracking", self._classify_track))
+            else:
+                stages = (("detection", self._detect), ("classification", self._classify), ("tracking", self._track))
+            for name, stage in stages:
+                thread = threading.Thread(target=self._run_stage, args=(stage,), name=name, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def _put(self, stage_queue, item):
+        #blocks while the next stage is busy, gives up when the pipeline is stopped
+        while self.running:
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, stage_queue):
+        while self.running:
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return STOP
+
+    def _run_stage(self, stage):
+        try:
+            stage()
+        except Exception as error:
+            #re-raised by read() on the consumer thread
+            self.error = error
+            self._put(self.results, STOP)
+
+    def detect(self, frame):
+        """
+        Detection stage, behind the idle scheduler
+        """
+        if self.idle_scheduler is None:
+            return self.controller.detect(frame)
+        with self.controller.lock:
+            #lost tracks live on for max_age frames, only the recently seen ones count as tracking
+            tracking = any(trk["tracker"].time_since_update <= TRACK_GRACE for trk in self.controller.tracks)
+        if self.idle_scheduler.should_detect(frame, tracking):
+            bboxes, probs = self.controller.detect(frame)
+            if bboxes is not None and len(bboxes):
+                self.idle_scheduler.activity()
+        else:
+            #static scene: the tracker sees a frame without hands, as when the detector finds none
+            bboxes, probs = np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32)
+        self.grabber.frame_interval = self.idle_scheduler.frame_interval
+        return bboxes, probs
+
+    def _detect(self):
+        while self.running:
+            ret, frame, timestamp = self.grabber.read(timeout=0.1)
+            if not ret:
+                if self.grabber.is_running():
+                    continue
+                break
+            bboxes, probs = self.detect(frame)
+            if not self._put(self.detected, (frame, timestamp, bboxes, probs)):
+                return
+        self._put(self.detected, STOP)
+
+    def _classify(self):
+        while True:
+            item = self._get(self.detected)
+            if item is STOP:
+                break
+            frame, timestamp, bboxes, probs = item
+            labels = self.controller.classify(frame, bboxes)
+            if not self._put(self.classified, (frame, timestamp, bboxes, probs, labels)):
+                return
+        self._put(self.classified, STOP)
+
+    def _track(self):
+        while True:
+            item = self._get(self.classified)
+            if item is STOP:
+                break
+            frame, timestamp, bboxes, probs, labels = item
+            result = self.controller.track(bboxes, probs, labels, frame)
+            if not self._put(self.results, (frame, timestamp, result)):
+                return
+        self._put(self.results, STOP)
+
+    def _classify_track(self):
+        #classifies and tracks each frame in turn, coasting classifies the predicted boxes on this thread too
+        while True:
+            item = self._get(self.detected)
+            if item is STOP:
+                break
+            frame, timestamp, bboxes, probs = item
+            result = self.controller.track(bboxes, probs, self.controller.classify(frame, bboxes), frame)
+            if not self._put(self.results, (frame, timestamp, result)):
+                return
+        self._put(self.results, STOP)
+
+    def is_running(self):
+        return not self.finished
+
+    def read(self, timeout=None):
+        """
+        Next processed frame, in capture order
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for a result, None waits until the camera stops
+
+        Returns
+        -------
+        tuple
+            (ret, frame, bboxes, ids, labels) as MainController.__call__ returns them for frame.
+            ret is False when the camera stopped or the timeout expired. Read controller.tracks
+            holding controller.lock, the tracking stage may already be updating the next frame
+        """
+        if self.threaded:
+            try:
+                item = self.results.get(timeout=timeout)
+            except queue.Empty:
+                return False, None, None, None, None
+            if item is STOP:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+                return False, None, None, None, None
+            frame, timestamp, (bboxes, ids, labels) = item
+        else:
+            ret, frame, timestamp = self.grabber.read(timeout=timeout)
+            if not ret:
+                self.finished = not self.grabber.is_running()
+                return False, None, None, None, None
+            bboxes, probs = self.detect(frame)
+            labels = self.controller.classify(frame, bboxes)
+            bboxes, ids, labels = self.controller.track(bboxes, probs, labels, frame)
+        self.latencies.append(time.perf_counter() - timestamp)
+        return True, frame, bboxes, ids, labels
+
+    def stats(self):
+        """
+        Capture statistics of the grabber, plus result_latency_ms: mean capture-to-result latency
+        in ms over the recent frames
+
+        Returns
+        -------
+        dict
+        """
+        stats = self.grabber.stats()
+        stats["result_latency_ms"] = float(np.mean(self.latencies) * 1000) if self.latencies else 0.0
+        return stats
+
+    def stop(self):
+        """
+        Stop the stage threads and the grabber
+        """
+        self.running = False
+        self.grabber.stop()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.finished = True
@@ -0,0 +1,208 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import onnx
+from onnx import version_converter
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from .onnx_models import HandClassification, HandDetection, model_variant_path
+from .utils import FrameGrabber
+from .utils.box_utils_numpy import iou_matrix
+
+#only the convolutions are quantized: the detector's box decoding and NMS tail stays in float
+OPS_TO_QUANTIZE = ["Conv", "MatMul", "Gemm"]
+#per-channel QDQ needs DequantizeLinear with axis (opset 13). hand_detector.onnx is exported with opset 11
+MIN_OPSET = 13
+
+
+class ModelCalibrationReader(CalibrationDataReader):
+    def __init__(self, model, images):
+        """
+        Feeds calibration images to the quantizer, preprocessed exactly as at inference time
+
+        Parameters
+        ----------
+        model : OnnxModel
+            Float model whose preprocessing is used
+        images : list
+            BGR frames (detector) or hand crops (classifier)
+        """
+        self.model = model
+        self.images = iter(images)
+
+    def get_next(self):
+        image = next(self.images, None)
+        if image is None:
+            return None
+        #preprocess() reuses the model buffer, the quantizer may keep the tensor
+        return {self.model.input_name: self.model.preprocess(image).copy()}
+
+
+def load_images(folder):
+    return [cv2.imread(path) for path in sorted(glob.glob(os.path.join(folder, "*.png")))]
+
+
+def record(args):
+    """
+    Record calibration frames from the camera, and the hand crops the float detector finds in them
+    """
+    detector = HandDetection(args.detector)
+    classifier = HandClassification(args.classifier)
+    os.makedirs(os.path.join(args.calibration, "frames"), exist_ok=True)
+    os.makedirs(os.path.join(args.calibration, "crops"), exist_ok=True)
+    grabber = FrameGrabber(args.source, 1280, 720, flip=True).start()
+    saved = crops_saved = count = 0
+    while saved < args.frames and grabber.is_running():
+        ret, frame, _ = grabber.read(timeout=5.0)
+        if not ret:
+            break
+        count += 1
+        if count % args.every:
+            continue
+        cv2.imwrite(os.path.join(args.calibration, "frames", f"{saved:05d}.png"), frame)
+        boxes, _ = detector(frame)
+        for i, crop in enumerate(classifier.get_crops(frame, boxes)):
+            if crop is not None:
+                cv2.imwrite(os.path.join(args.calibration, "crops", f"{saved:05d}_{i}.png"), crop)
+                crops_saved += 1
+        saved += 1
+        print(f"\rframes {saved}/{args.frames}, crops {crops_saved}", end="")
+    grabber.stop()
+    print()
+
+
+def quantize_model(model_path, output_path, reader):
+    """
+    Static INT8 quantization (QDQ, per-channel weights) of one model
+
+    Parameters
+    ----------
+    model_path : str
+        Float onnx model
+    output_path : str
+        Where the INT8 model is written
+    reader : CalibrationDataReader
+        Calibration data
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        #shape inference and graph cleanup first, as recommended for static quantization (the models have static shapes, no sympy needed)
+        prepared = os.path.join(tmp, "prepared.onnx")
+        model = onnx.load(model_path)
+        opset = next(opset.version for opset in model.opset_import if opset.domain in ("", "ai.onnx"))
+        if opset < MIN_OPSET:
+            model_path = os.path.join(tmp, "converted.onnx")
+            onnx.save(version_converter.convert_version(model, MIN_OPSET), model_path)
+        quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+        quantize_static(
+            prepared,
+            output_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=OPS_TO_QUANTIZE,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    print(f"Saved {output_path}")
+
+
+def quantize(args):
+    frames = load_images(os.path.join(args.calibration, "frames"))
+    crops = load_images(os.path.join(args.calibration, "crops"))
+    if not frames or not crops:
+        raise FileNotFoundError(f"No calibration frames or crops in {args.calibration}, run the record command first")
+    quantize_model(
+        args.detector, model_variant_path(args.detector, "int8"), ModelCalibrationReader(HandDetection(args.detector), frames)
+    )
+    quantize_model(
+        args.classifier,
+        model_variant_path(args.classifier, "int8"),
+        ModelCalibrationReader(HandClassification(args.classifier), crops),
+    )
+    report(args)
+
+
+def latency(model, images, call):
+    times = np.empty(len(images))
+    for i, image in enumerate(images):
+        start = time.perf_counter()
+        call(model, image)
+        times[i] = (time.perf_counter() - start) * 1000
+    return np.median(times)
+
+
+def detection_agreement(float_dets, int8_dets):
+    """
+    Fraction of frames where both models agree on the top detection: both find nothing,
+    or their highest-scoring boxes overlap with IoU >= 0.5
+    """
+    agree = 0
+    for (float_boxes, _), (int8_boxes, _) in zip(float_dets, int8_dets):
+        if len(float_boxes) == 0 or len(int8_boxes) == 0:
+            agree += len(float_boxes) == len(int8_boxes)
+        else:
+            agree += iou_matrix(float_boxes[:1].astype(np.float32), int8_boxes[:1].astype(np.float32))[0, 0] >= 0.5
+    return agree / max(len(float_dets), 1)
+
+
+def report(args):
+    """
+    Latency and top-1 agreement of the INT8 models against the float models on the calibration data
+    """
+    frames = load_images(os.path.join(args.calibration, "frames"))
+    crops = load_images(os.path.join(args.calibration, "crops"))
+    float_detector = HandDetection(args.detector)
+    int8_detector = HandDetection(model_variant_path(args.detector, "int8"))
+    float_classifier = HandClassification(args.classifier)
+    int8_classifier = HandClassification(model_variant_path(args.classifier, "int8"))
+
+    def detect(model, frame):
+        return model(frame)
+
+    def classify(model, crop):
+        return model(crop, np.array([[0, 0, crop.shape[1], crop.shape[0]]]))
+
+    float_dets = [detect(float_detector, frame) for frame in frames]
+    int8_dets = [detect(int8_detector, frame) for frame in frames]
+    float_labels = np.concatenate([classify(float_classifier, crop) for crop in crops])
+    int8_labels = np.concatenate([classify(int8_classifier, crop) for crop in crops])
+
+    print(f"{'model':<12}{'float ms':>10}{'int8 ms':>10}{'speedup':>10}{'top-1 agreement':>18}")
+    for name, float_model, int8_model, images, call, agreement in (
+        ("detector", float_detector, int8_detector, frames, detect, detection_agreement(float_dets, int8_dets)),
+        ("classifier", float_classifier, int8_classifier, crops, classify, np.mean(float_labels == int8_labels)),
+    ):
+        float_ms = latency(float_model, images, call)
+        int8_ms = latency(int8_model, images, call)
+        print(f"{name:<12}{float_ms:>10.2f}{int8_ms:>10.2f}{float_ms / int8_ms:>9.2f}x{agreement:>17.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Static INT8 quantization of the detector and classifier")
+    parser.add_argument("command", choices=["record", "quantize", "report"])
+    parser.add_argument(
+        "--detector", default="dynamic_gestures/models/hand_detector.onnx", type=str, help="Path to detector onnx model"
+    )
+    parser.add_argument(
+        "--classifier",
+        default="dynamic_gestures/models/crops_classifier.onnx",
+        type=str,
+        help="Path to classifier onnx model",
+    )
+    parser.add_argument(
+        "--calibration", default="dynamic_gestures/calibration", type=str, help="Calibration frames and crops folder"
+    )
+    parser.add_argument("--source", default=0, help="Camera index or video file to record from")
+    parser.add_argument("--frames", default=200, type=int, help="Frames to record")
+    parser.add_argument("--every", default=5, type=int, help="Record one frame out of every n")
+    args = parser.parse_args()
+    if isinstance(args.source, str) and args.source.isdigit():
+        args.source = int(args.source)
+    {"record": record, "quantize": quantize, "report": report}[args.command](args)
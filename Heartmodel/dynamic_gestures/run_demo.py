@@ -4,24 +4,38 @@ import time
 import cv2
 import numpy as np
 
+from .idle_scheduler import IdleScheduler
 from .main_controller import MainController
-from .utils import Drawer, Event, targets
+from .onnx_models import MODEL_VARIANTS, SessionConfig
+from .pipeline import PipelinedController
+from .utils import Drawer, Event, FrameGrabber, targets
 
 #main function to run the demo
 def run(args):
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    #capture on its own thread: every iteration gets the newest frame (mirrored), stale ones are dropped
+    grabber = FrameGrabber(0, 1280, 720, flip=True).start()
 
-    controller = MainController(args.detector, args.classifier) #tracking system
+    controller = MainController(
+        args.detector,
+        args.classifier,
+        session_config=SessionConfig.from_args(args),
+        model_variant=args.model_variant,
+        detection_interval=args.detection_interval,
+        max_label_reuse=args.max_label_reuse,
+    ) #tracking system
+    #detection, classification and tracking as pipeline stages on worker threads, frames still come out in order
+    #no detection on a static empty scene, and a lower capture rate after --idle-after seconds without activity
+    idle_scheduler = IdleScheduler(args.idle_after, args.idle_fps) if args.idle_after > 0 else None
+    pipeline = PipelinedController(controller, grabber, threaded=args.pipelined, idle_scheduler=idle_scheduler).start()
     drawer = Drawer() #visual rendering
     debug_mode = args.debug
-    while cap.isOpened():
-        ret, frame = cap.read()
-        frame = cv2.flip(frame, 1)
+    last_result = time.time()
+    while pipeline.is_running():
+        ret, frame, bboxes, ids, labels = pipeline.read() #detection, classification and tracking
         if ret:
-            start_time = time.time()
-            bboxes, ids, labels = controller(frame) #detection and classification
+            now = time.time()
+            fps = 1.0 / max(now - last_result, 1e-6)
+            last_result = now
             if debug_mode:
                 if bboxes is not None:
                     bboxes = bboxes.astype(np.int32)
@@ -41,73 +55,71 @@ def run(args):
                             2,
                         )
                 #display fps
-                fps = 1.0 / (time.time() - start_time)
                 cv2.putText(frame, f"fps {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                stats = pipeline.stats()
+                cv2.putText(frame, f"latency {stats['result_latency_ms']:.0f} ms, dropped {stats['dropped']}", (10, 60),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
             
-            #process track info for gesture-effects
-            if len(controller.tracks) > 0:
+            #process track info for gesture-effects, the tracking stage may already be updating the next frame:
+            #the last hands and the action of each track are taken under the lock, the effects run after it
+            with controller.lock:
+                tracks = [(trk["tracker"].time_since_update, trk['hands'][-4:], trk["hands"].action) for trk in controller.tracks]
+                for trk in controller.tracks:
+                    #every action but DRAG is consumed once handled
+                    if trk["tracker"].time_since_update < 1 and trk["hands"].action not in (None, Event.DRAG, Event.UNKNOWN):
+                        trk["hands"].action = None
+            if len(tracks) > 0:
                 count_of_zoom = 0
                 thumb_boxes = []
-                for trk in controller.tracks:
-                    if trk["tracker"].time_since_update < 1:
-                        if len(trk['hands']):
-                            count_of_zoom += (trk['hands'][-1].gesture == 3)
+                for time_since_update, hands, action in tracks:
+                    if time_since_update < 1:
+                        if len(hands):
+                            count_of_zoom += (hands[-1].gesture == 3)
 
-                            thumb_boxes.append(trk['hands'][-1].bbox)
-                            if len(trk['hands']) > 3 and [trk['hands'][-1].gesture, trk['hands'][-2].gesture, trk['hands'][-3].gesture] == [23, 23, 23]:
-                                x, y, x2, y2 = map(int, trk['hands'][-1].bbox)
+                            thumb_boxes.append(hands[-1].bbox)
+                            if len(hands) > 3 and [hands[-1].gesture, hands[-2].gesture, hands[-3].gesture] == [23, 23, 23]:
+                                x, y, x2, y2 = map(int, hands[-1].bbox)
                                 x, y, x2, y2 = max(x, 0), max(y, 0), max(x2, 0), max(y2, 0)
                                 bbox_area = frame[y:y2, x:x2]
                                 blurred_bbox = cv2.GaussianBlur(bbox_area, (51, 51), 10)
                                 frame[y:y2, x:x2] = blurred_bbox
 
-                        if trk["hands"].action is not None:
-                            if Event.SWIPE_LEFT == trk["hands"].action or  Event.SWIPE_LEFT3 == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                        if action is not None:
+                            if Event.SWIPE_LEFT == action or  Event.SWIPE_LEFT3 == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.SWIPE_RIGHT == trk["hands"].action or Event.SWIPE_RIGHT3 == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.SWIPE_RIGHT == action or Event.SWIPE_RIGHT3 == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.SWIPE_UP == trk["hands"].action or Event.SWIPE_UP3 == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.SWIPE_UP == action or Event.SWIPE_UP3 == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.SWIPE_DOWN == trk["hands"].action or Event.SWIPE_DOWN3 == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.SWIPE_DOWN == action or Event.SWIPE_DOWN3 == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.DRAG == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
+                            elif Event.DRAG == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.DROP == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.DROP == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.ZOOM_IN == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.ZOOM_IN == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.ZOOM_OUT == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.ZOOM_OUT == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.DOUBLE_TAP == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.DOUBLE_TAP == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.TAP == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.TAP == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.LITTLE_FINGER == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.LITTLE_FINGER == action:
+                                drawer.set_action(action)
                                 ...
-                            elif Event.STOP == trk["hands"].action:
-                                drawer.set_action(trk["hands"].action)
-                                trk["hands"].action = None
+                            elif Event.STOP == action:
+                                drawer.set_action(action)
                                 ...
                                 
                                 
@@ -119,6 +131,10 @@ def run(args):
             cv2.imshow("frame", frame)
             if cv2.waitKey(1) & 0xFF == ord("q"):
                 break
+    pipeline.stop()
+    print(f"Capture stats: {pipeline.stats()}")
+    if controller.classification_cache is not None:
+        print(f"Classification cache: {controller.classification_cache.stats()}")
 
 #command arguments: detector and classifier
 if __name__ == "__main__":
@@ -139,5 +155,31 @@ if __name__ == "__main__":
     )
 
     parser.add_argument("--debug", required=False, action="store_true", help="Debug mode")
+    parser.add_argument(
+        "--model-variant", default="float", choices=MODEL_VARIANTS, help="int8: quantized models (dynamic_gestures.quantize)"
+    )
+    parser.add_argument(
+        "--detection-interval",
+        default=1,
+        type=int,
+        help="Maximum frames between full detections, the tracker predicts the hands in between",
+    )
+    parser.add_argument(
+        "--max-label-reuse",
+        default=0,
+        type=int,
+        help="Frames a hand whose crop barely changed may reuse its label before it is classified again",
+    )
+    parser.add_argument(
+        "--idle-after",
+        default=0,
+        type=float,
+        help="Seconds without motion or hands before the capture rate drops to --idle-fps, 0 disables motion gating",
+    )
+    parser.add_argument("--idle-fps", default=5, type=float, help="Capture and detection rate while idle")
+    parser.add_argument(
+        "--pipelined", action="store_true", help="Run detection, classification and tracking as overlapping pipeline stages"
+    )
+    SessionConfig.add_arguments(parser)
     args = parser.parse_args()
     run(args)
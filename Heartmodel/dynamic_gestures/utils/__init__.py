@@ -1,16 +1,22 @@
 from .action_controller import Deque
-from .box_utils_numpy import hard_nms
+from .box_utils_numpy import filter_detections, hard_nms, hard_nms_vectorized
 from .drawer import Drawer
 from .enums import Event, HandPosition, targets
+from .frame_grabber import FrameGrabber
 from .hand import Hand
+from .motion import MotionDetector
 
 
 __all__ = [
     "Deque",
     "hard_nms",
+    "hard_nms_vectorized",
+    "filter_detections",
     "Drawer",
     "Event",
     "HandPosition",
     "targets",
-    "Hand"
+    "FrameGrabber",
+    "Hand",
+    "MotionDetector",
 ]
\ No newline at end of file
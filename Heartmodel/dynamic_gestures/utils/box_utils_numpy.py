@@ -176,3 +176,84 @@ def hard_nms(box_scores, iou_threshold, top_k=-1, candidate_size=200):
         indexes = indexes[iou <= iou_threshold]
 
     return box_scores[picked, :]
+
+
+def iou_matrix(boxes0, boxes1, eps=1e-5):
+    """
+    Pairwise intersection-over-union of two sets of boxes.
+    Parameters
+    ----------
+    boxes0: numpy.ndarray
+        Boxes in corner-form, sized [N,4].
+    boxes1: numpy.ndarray
+        Boxes in corner-form, sized [M,4].
+    eps: float
+        A small number to avoid 0 as denominator.
+
+    Returns
+    -------
+    iou: numpy.ndarray
+        IoU values, sized [N,M].
+    """
+    return iou_of(boxes0[:, None, :], boxes1[None, :, :], eps)
+
+
+def hard_nms_vectorized(box_scores, iou_threshold, top_k=-1, candidate_size=200):
+    """
+    Same greedy suppression as hard_nms, but all IoUs are computed at once as a matrix
+    and the loop only flips boolean masks
+    Parameters
+    ----------
+    box_scores: numpy.ndarray
+        boxes in corner-form and probabilities.
+    iou_threshold: float
+        intersection over union threshold.
+    top_k: int
+        keep top_k results. If k <= 0, keep all the results.
+    candidate_size: int
+        only consider the candidates with the highest scores.
+
+    Returns
+    -------
+    picked: numpy.ndarray
+        the kept rows of box_scores, highest score first
+    """
+    order = np.argsort(box_scores[:, -1])[::-1][:candidate_size]
+    boxes = box_scores[order, :-1]
+    suppresses = iou_matrix(boxes, boxes) > iou_threshold
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1 :] &= ~suppresses[i, i + 1 :]
+    picked = order[keep]
+    if top_k > 0:
+        picked = picked[:top_k]
+    return box_scores[picked, :]
+
+
+def filter_detections(boxes, scores, score_threshold, iou_threshold, top_k=-1):
+    """
+    Score threshold, NMS and top-k in one step.
+    Parameters
+    ----------
+    boxes: numpy.ndarray
+        Boxes in corner-form, sized [N,4].
+    scores: numpy.ndarray
+        Probabilities, sized [N,].
+    score_threshold: float
+        Boxes with a score not above it are dropped.
+    iou_threshold: float
+        intersection over union threshold for NMS.
+    top_k: int
+        keep top_k results. If k <= 0, keep all the results.
+
+    Returns
+    -------
+    dets: numpy.ndarray
+        Kept boxes and scores [x1,y1,x2,y2,score], sized [K,5], highest score first.
+    """
+    keep = scores > score_threshold
+    box_scores = np.concatenate((boxes[keep], scores[keep, None]), axis=1)
+    if len(box_scores) <= 1:
+        return box_scores
+    return hard_nms_vectorized(box_scores, iou_threshold, top_k)
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+#captures frames on its own thread so inference always gets the newest frame instead of the oldest one waiting in the driver queue
+class FrameGrabber:
+    def __init__(self, source=0, width=None, height=None, flip=False, buffer_size=2, latency_window=120):
+        """
+        Threaded camera capture with a latest-frame-wins policy
+
+        Parameters
+        ----------
+        source : int or str
+            cv2.VideoCapture source (camera index or video path)
+
+        width : int
+            Requested capture width
+
+        height : int
+            Requested capture height
+
+        flip : bool
+            Mirror frames horizontally on the grabber thread
+
+        buffer_size : int
+            Frames kept in the ring buffer. Older frames are dropped when it is full
+            and every frame older than the one returned by read() is dropped too
+
+        latency_window : int
+            Number of recent capture-to-inference latencies kept for stats()
+        """
+        self.source = source
+        self.width = width
+        self.height = height
+        self.flip = flip
+        self.buffer = deque(maxlen=buffer_size) #(frame, capture timestamp)
+        self.condition = threading.Condition()
+        self.cap = None
+        self.thread = None
+        self.running = False
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.frame_interval = 0.0 #minimum seconds between decoded frames, set by IdleScheduler
+
+    def start(self):
+        """
+        Open the camera and start the grabber thread
+
+        Returns
+        -------
+        FrameGrabber
+            self, so it can be chained after the constructor
+        """
+        self.cap = cv2.VideoCapture(self.source)
+        if self.width is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        #keep the driver queue as short as the backend allows, stale frames are dropped here anyway
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.running = self.cap.isOpened()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            timestamp = time.perf_counter()
+            if not ret:
+                break
+            if self.flip:
+                frame = cv2.flip(frame, 1)
+            with self.condition:
+                if len(self.buffer) == self.buffer.maxlen:
+                    self.dropped += 1
+                self.buffer.append((frame, timestamp))
+                self.captured += 1
+                self.condition.notify()
+            #lower capture rate: the camera keeps streaming, frames are only grabbed (not decoded) until the next one is due
+            while self.running and time.perf_counter() - timestamp < self.frame_interval:
+                if not self.cap.grab():
+                    break
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        #released here, never while this thread may still be blocked on it
+        self.cap.release()
+
+    def is_running(self):
+        return self.running or len(self.buffer) > 0
+
+    def read(self, timeout=None):
+        """
+        Wait for a new frame and return the newest one
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for a frame, None waits until the camera stops
+
+        Returns
+        -------
+        tuple
+            (ret, frame, timestamp): frame is a BGR np.ndarray owned by the caller and
+            timestamp its time.perf_counter() capture time. (False, None, None) when
+            the camera stopped or the timeout expired
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.buffer or not self.running, timeout):
+                return False, None, None
+            if not self.buffer:
+                return False, None, None
+            frame, timestamp = self.buffer.pop()
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+            self.delivered += 1
+        self.latencies.append(time.perf_counter() - timestamp)
+        return True, frame, timestamp
+
+    def stats(self):
+        """
+        Capture statistics
+
+        Returns
+        -------
+        dict
+            captured, delivered and dropped frame counts, and the mean and max
+            capture-to-inference latency in ms over the recent frames
+        """
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "captured": self.captured,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "latency_ms": float(latencies.mean()),
+            "max_latency_ms": float(latencies.max()),
+        }
+
+    def stop(self):
+        """
+        Stop the grabber thread, which releases the camera once its current read returns
+        """
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
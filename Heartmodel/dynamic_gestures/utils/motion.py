@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+
+#cheap motion check: difference between consecutive heavily downscaled grayscale frames
+class MotionDetector:
+    def __init__(self, size=(80, 45), pixel_threshold=25):
+        """
+        Frame difference motion detector
+
+        Parameters
+        ----------
+        size : tuple
+            (width, height) of the downscaled grayscale frames compared
+
+        pixel_threshold : int
+            Gray level change that counts a downscaled pixel as changed
+        """
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.previous = None
+
+    def __call__(self, frame, boxes=()):
+        """
+        Fraction of pixels that changed since the previous frame, call it on every frame
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            BGR frame
+
+        boxes : list
+            [x1, y1, x2, y2] boxes whose motion is ignored, with half a box of margin
+
+        Returns
+        -------
+        float
+            1.0 on the first frame
+        """
+        small = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        previous, self.previous = self.previous, small
+        if previous is None:
+            return 1.0
+        changed = cv2.absdiff(small, previous) > self.pixel_threshold
+        scale_x = self.size[0] / frame.shape[1]
+        scale_y = self.size[1] / frame.shape[0]
+        for x1, y1, x2, y2 in boxes:
+            margin_x, margin_y = (x2 - x1) / 2, (y2 - y1) / 2
+            changed[
+                max(int((y1 - margin_y) * scale_y), 0) : max(int(np.ceil((y2 + margin_y) * scale_y)), 0),
+                max(int((x1 - margin_x) * scale_x), 0) : max(int(np.ceil((x2 + margin_x) * scale_x)), 0),
+            ] = False
+        return changed.mean()
@@ -5,72 +5,116 @@ from model import *
 from camera import Camera
 from light import Light
 from scene import Scene
+from overlay import Overlay, StreamingTexture
+from timestep import FixedTimestep
+from uniforms import FrameUniforms, FULL_TILE, TOP_LEFT_TILE, BOTTOM_LEFT_TILE, BOTTOM_RIGHT_TILE, TOP_RIGHT_TILE
 import cv2
 import time
+import argparse
+import numpy as np
+
+#posicio del quad de la webcam (NDC): bottom-right corner
+WEBCAM_RECT = (0.4, -1.0, 1.0, -0.4)
 
 #Main app for everything: rendering/input/scene
 class GraphicsEngine:
-    def __init__(self, models_data = [((0, -2, -10), (0, 0, 0), (1, 1, 1), 100 , [1]*100)], win_size=(1000, 800)): #1000, 800
-        # init pygame modules
-        pg.init()
-        pg.mixer.init()
+    def __init__(self, models_data = [((0, -2, -10), (0, 0, 0), (1, 1, 1), 100 , [1]*100)], win_size=(1000, 800), webcam_downscale=True, max_fps=60, headless=False): #1000, 800
         # window size
         self.WIN_SIZE = win_size
-        # set opengl attr
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE)
-        # create opengl context
-        pg.display.set_mode(self.WIN_SIZE, flags=pg.OPENGL | pg.DOUBLEBUF)
-        # detect and use existing opengl context
-        self.ctx = mgl.create_context()
+        #headless: sense finestra ni audio (servidors de build, containers). Es dibuixa a un framebuffer offscreen
+        self.headless = headless
+        if headless:
+            self.ctx = self.create_headless_context()
+            self.fbo = self.ctx.simple_framebuffer(self.WIN_SIZE)
+            self.fbo.use()
+        else:
+            # init pygame modules
+            pg.init()
+            pg.mixer.init()
+            # set opengl attr
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE)
+            # create opengl context
+            pg.display.set_mode(self.WIN_SIZE, flags=pg.OPENGL | pg.DOUBLEBUF)
+            # detect and use existing opengl context
+            self.ctx = mgl.create_context()
+            self.fbo = self.ctx.screen
         # self.ctx.front_face = 'cw'
         self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE)
         # create an object to help track time
         self.clock = pg.time.Clock()
         self.time = 0
-        self.delta_time = 0
+        self.delta_time = 0 #ms del frame anterior
+        #limit del render (30 en maquines poc potents): la simulacio va a pas fix igualment
+        self.max_fps = max_fps
+        self.timestep = FixedTimestep()
+        self.alpha = 1.0 #interpolacio del render entre els dos ultims passos de simulacio
         # light
         self.light = Light()
         # camera
         self.camera = Camera(self)
+        # uniform buffer amb camera (totes les vistes) i llum, compartit per tots els programes
+        self.frame_uniforms = FrameUniforms(self.ctx)
+        self.frame_uniforms.write_light(self.light)
+        self.quad_proj = self.camera.m_proj
         # scene
         self.scene = Scene(self, models_data)
         
         #AFEGIT PER DOBLE VISTA (webcam texture):
         self.latest_camera_frame_data = None
         self.latest_camera_frame_ready = False
-        self.webcam_texture = None
+        self.webcam_stream = None
+        #reduir el frame a la mida del quad abans de pujar-lo (720p per un quad de ~300px es malbaratar ample de banda)
+        self.webcam_downscale = webcam_downscale
+        #overlay 2D (webcam picture-in-picture a baix a la dreta, panells de debug)
+        #el frame de la webcam es puja en BGR i sense girar: el shader de l'overlay fa el swizzle i el flip
+        self.overlay = Overlay(self.ctx)
+        self.overlay.add_layer('webcam', WEBCAM_RECT, bgr=True, flip_y=True)
+        self.webcam_size = self.overlay.layer_size('webcam', self.WIN_SIZE)
+
+    #context OpenGL sense display: EGL (GPU o llvmpipe), i si no n'hi ha el backend per defecte de la plataforma
+    @staticmethod
+    def create_headless_context():
+        try:
+            return mgl.create_standalone_context(require=330, backend='egl')
+        except Exception as e:
+            print(f"[Warning] EGL no disponible ({e}), provant el context standalone per defecte")
+            return mgl.create_standalone_context(require=330)
 
     #ADDED METHODS per veure'm a mi en la pantalla: update_camera_frame i update_webcam_texture
     def update_camera_frame(self, frame):
-    #processa i guarda cada frame
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) #de BGR a RGB
-        rgb = np.flipud(rgb) #flip perque opencv i opengl diff coordinades
-        self.latest_camera_frame_data = rgb #guarda resultat
+    #guarda cada frame (BGR, tal com surt d'OpenCV). Nomes es copia si cal reduir-lo
+        h, w, _ = frame.shape
+        if self.webcam_downscale and (w > self.webcam_size[0] or h > self.webcam_size[1]):
+            frame = cv2.resize(frame, self.webcam_size, interpolation=cv2.INTER_AREA)
+        self.latest_camera_frame_data = frame #guarda resultat
         self.latest_camera_frame_ready = True
         
     def update_webcam_texture(self):
     #carrega el frame a la GPU com a texture
         frame = self.latest_camera_frame_data #agafa frame guardat
+        self.latest_camera_frame_ready = False
         h, w, _ = frame.shape
         
-        #crear una opengl texture
-        if self.webcam_texture is None or self.webcam_texture.size != (w, h):
-            self.webcam_texture = self.ctx.texture((w, h), components=3)
-            self.webcam_texture.repeat_x = False
-            self.webcam_texture.repeat_y = False
-            self.webcam_texture.filter = (mgl.LINEAR, mgl.LINEAR)
+        #crear una opengl texture (amb els seus pixel buffers)
+        if self.webcam_stream is None or self.webcam_stream.size != (w, h):
+            if self.webcam_stream is not None:
+                self.webcam_stream.release()
+            self.webcam_stream = StreamingTexture(self.ctx, (w, h))
+            self.overlay.set_texture('webcam', self.webcam_stream.texture)
         
         #carrega la webcam frame com texture
-        self.webcam_texture.write(frame.tobytes())
-        self.latest_camera_frame_ready = False
+        self.webcam_stream.write(frame)
 
     #keyboard events and exit
     #eliminar els de j,k, l després tot va bé
     def check_events(self):
         for event in pg.event.get():
             if event.type == pg.QUIT or (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
+                if self.webcam_stream is not None:
+                    self.webcam_stream.release()
+                self.overlay.release()
                 pg.quit()
                 sys.exit()
             
@@ -136,7 +180,30 @@ class GraphicsEngine:
     def toggle_perspective_view(self): #instead of "p" key to change perspective, use the gesture action = Double Click
         self.camera.perspectiva = not self.camera.perspectiva
         self.camera.zoom = glm.vec3((0, 0, 0))
+        self.camera.prev_zoom = glm.vec3((0, 0, 0))
     
+    #camera (position, up, forward) i tile de cada vista del mode ortografic
+    def get_quad_views(self):
+        if len(self.scene.objects) > 1:
+            alzado, perfil, axonometrica, planta = (0, -2, -7), (-3.5, -2, -10), (-1.5, -2, -7), (0, 1.5, -10)
+        else:
+            alzado, perfil, axonometrica, planta = (0, -2, -7.5), (-2.5, -2, -10), (-1.5, -2, -8), (0, 0.5, -10)
+        return [
+            (alzado, (0, 1, 0), (0, 0, -1), TOP_LEFT_TILE), # Vista Alzado
+            (perfil, (0, 1, 0), (1, 0, 0), BOTTOM_LEFT_TILE), # Vista Perfil
+            (axonometrica, (0, 1, 0), glm.normalize(glm.vec3(0, -2, -10) - glm.vec3(axonometrica)), BOTTOM_RIGHT_TILE), # Vista Axonométrica
+            (planta, (0, 0, -1), (0, -1, 0), TOP_RIGHT_TILE), # Vista Planta
+        ]
+
+    #avança la simulacio (camera, batec, rotacio) en passos fixos pel temps real del frame anterior
+    #aixi el ppm i la resposta als gestures no depenen del frame rate
+    def update_simulation(self):
+        for _ in range(self.timestep.advance(self.delta_time * 0.001)):
+            if self.camera.perspectiva:
+                self.camera.move(self.timestep.dt)
+            self.scene.animate(self.timestep.dt)
+        self.alpha = self.timestep.alpha
+
     def render(self):
         #render the 4 perspectives or 1
         # clear framebuffer
@@ -145,110 +212,79 @@ class GraphicsEngine:
         #ADDED webcam texture
         if self.latest_camera_frame_ready:
             self.update_webcam_texture()
-        
-        if self.webcam_texture:
-            self.render_webcam_quad()
 
+        self.ctx.viewport = (0, 0, self.WIN_SIZE[0], self.WIN_SIZE[1])
         if self.camera.perspectiva:
-            self.ctx.viewport = (0,0,self.WIN_SIZE[0],self.WIN_SIZE[1])
             self.camera.update((0, -2, -6),(0, 1, 0), (0, 0, -1))
-            self.camera.move()
+            self.frame_uniforms.write_views(self.camera.m_proj, [(self.camera.m_view, self.camera.position, FULL_TILE)])
             self.scene.render()
         else:
-            # Vista Alzado
-            self.ctx.viewport = (0, self.WIN_SIZE[1] // 2, self.WIN_SIZE[0] // 2, self.WIN_SIZE[1] // 2)
-            if len(self.scene.objects) > 1:
-                self.camera.update((0, -2, -7),(0, 1, 0), (0, 0, -1))
-            else:
-                self.camera.update((0, -2, -7.5),(0, 1, 0), (0, 0, -1))
-            self.scene.render()
-
-            # Vista Perfil
-            self.ctx.viewport = (0, 0, self.WIN_SIZE[0] // 2, self.WIN_SIZE[1] // 2)
-            if len(self.scene.objects) > 1:
-                self.camera.update((-3.5, -2, -10), (0, 1, 0), (1, 0, 0))
-            else:
-                self.camera.update((-2.5, -2, -10), (0, 1, 0), (1, 0, 0))
-            self.scene.render()
-
-            # Vista Axonométrica
-            self.ctx.viewport = (self.WIN_SIZE[0] // 2, 0, self.WIN_SIZE[0] // 2, self.WIN_SIZE[1] // 2)
-            if len(self.scene.objects) > 1:
-                self.camera.update((-1.5, -2, -7), (0, 1, 0), glm.normalize(glm.vec3(0, -2, -10) - glm.vec3(-1.5, -2, -7))) 
-            else:
-                self.camera.update((-1.5, -2, -8), (0, 1, 0), glm.normalize(glm.vec3(0, -2, -10) - glm.vec3(-1.5, -2, -8))) 
-            self.scene.render()
+            #les 4 vistes en un sol pas: cada objecte es dibuixa un cop amb una instancia per vista
+            views = []
+            for position, up, forward, tile in self.get_quad_views():
+                self.camera.update(position, up, forward)
+                views.append((self.camera.m_view, self.camera.position, tile))
+            #els programes nomes rebien m_proj a on_init, aixi que les 4 vistes sempre s'han vist amb la projeccio inicial
+            self.frame_uniforms.write_views(self.quad_proj, views)
+            self.frame_uniforms.enable_clipping()
+            self.scene.render(len(views))
+            self.frame_uniforms.disable_clipping()
 
-            # Vista Planta 
-            self.ctx.viewport = (self.WIN_SIZE[0] // 2, self.WIN_SIZE[1] // 2, self.WIN_SIZE[0] // 2, self.WIN_SIZE[1] // 2)
-            if len(self.scene.objects) > 1:
-                self.camera.update((0, 1.5, -10), (0, 0, -1), (0, -1, 0))
-            else:
-                self.camera.update((0, 0.5, -10), (0, 0, -1), (0, -1, 0))
-            self.scene.render()
-
-        self.scene.animate()
+        #overlay per sobre de l'escena (webcam)
+        self.overlay.render()
         
         # swap buffers
-        pg.display.flip()
+        if not self.headless:
+            pg.display.flip()
     
     
     
-    def render_webcam_quad(self):
-    #Dibuixar a quad en la pantalla amb la textura mapped= webcam
-        # Bottom-right corner. crear un quad rectangular
-        vertices = np.array([
-            0.4, -1.0, 0.0, 0.0, 0.0,
-            1.0, -1.0, 0.0, 1.0, 0.0,
-            1.0, -0.4, 0.0, 1.0, 1.0,
-            0.4, -0.4, 0.0, 0.0, 1.0,
-        ], dtype='f4')
-
-        indices = np.array([0, 1, 2, 2, 3, 0], dtype='i4')
-        vbo = self.ctx.buffer(vertices.tobytes())
-        ibo = self.ctx.buffer(indices.tobytes())
-        vao_content = [(vbo, '3f 2f', 'in_vert', 'in_text')]
-        
-        prog = self.ctx.program(
-            vertex_shader='''
-                #version 330
-                in vec3 in_vert;
-                in vec2 in_text;
-                out vec2 v_text;
-                void main() {
-                    gl_Position = vec4(in_vert, 1.0);
-                    v_text = in_text;
-                }
-            ''',
-            fragment_shader='''
-                #version 330
-                uniform sampler2D webcam_tex;
-                in vec2 v_text;
-                out vec4 f_color;
-                void main() {
-                    f_color = texture(webcam_tex, v_text);
-                }
-            ''',
-        )
+    def get_time(self):
+        self.time = pg.time.get_ticks() * 0.001
 
-        vao = self.ctx.vertex_array(prog, vao_content, ibo)
-        self.webcam_texture.use(location=0)
-        prog['webcam_tex'] = 0
-        vao.render()
+    #ultim frame dibuixat com a np.ndarray (h, w, 3) uint8 RGB, amb la primera fila a dalt
+    def read_frame(self):
+        data = self.fbo.read(components=3)
+        frame = np.frombuffer(data, dtype=np.uint8).reshape(self.WIN_SIZE[1], self.WIN_SIZE[0], 3)
+        return np.ascontiguousarray(frame[::-1])
 
+    #un frame sense event loop ni rellotge (headless): avança delta_time ms de simulacio, dibuixa i retorna el frame
+    def render_frame(self, delta_time=None):
+        self.delta_time = 1000 / self.max_fps if delta_time is None else delta_time
+        self.time += self.delta_time * 0.001
+        self.update_simulation()
+        self.render()
+        return self.read_frame()
 
-    def get_time(self):
-        self.time = pg.time.get_ticks() * 0.001
+    #benchmark headless: temps per frame de simulacio + render + lectura del framebuffer
+    def benchmark(self, frames=600):
+        times = np.empty(frames)
+        for i in range(frames):
+            start = time.perf_counter()
+            self.render_frame()
+            times[i] = time.perf_counter() - start
+        print(f"{frames} frames {self.WIN_SIZE[0]}x{self.WIN_SIZE[1]} ({self.ctx.info['GL_RENDERER']}): "
+              f"mean {times.mean() * 1000:.2f} ms, p95 {np.percentile(times, 95) * 1000:.2f} ms, {1 / times.mean():.1f} fps")
+        return times
     
     #MAIN LOOP
     def run(self):
         while True:
             self.get_time()
             self.check_events()
+            self.update_simulation()
             self.render()
-            self.delta_time = self.clock.tick(60)
+            self.delta_time = self.clock.tick(self.max_fps)
 
 if __name__ == '__main__':
-    app = GraphicsEngine()
-    app.run()
+    parser = argparse.ArgumentParser(description="Heart model renderer")
+    parser.add_argument("--headless", action="store_true", help="Render offscreen without a display or audio and print frame timings")
+    parser.add_argument("--frames", default=600, type=int, help="Frames to render in headless mode")
+    args = parser.parse_args()
+
+    app = GraphicsEngine(headless=args.headless)
+    if args.headless:
+        app.benchmark(args.frames)
+    else:
+        app.run()
 
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import struct
+
+import numpy as np
+import pywavefront
+
+#cache binari dels .obj: capçalera petita + vertexs float32 en cru, que es llegeix amb np.memmap sense copiar
+#els .obj.bin de pywavefront van comprimits amb gzip i no tenen hash del .obj, per aixo no es poden mapejar
+CACHE_EXT = '.mesh'
+MAGIC = b'HMESH001'
+#magic, vertex format, vertex count, floats per vertex, sha1 del .obj
+HEADER = struct.Struct('<8s16sII20s')
+HEADER_SIZE = 64 #les dades comencen alineades a 64 bytes
+
+
+#sha1 del fitxer font, per saber si el cache esta desfasat
+def source_hash(obj_file):
+    sha = hashlib.sha1()
+    with open(obj_file, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def cache_path(obj_file):
+    return obj_file + CACHE_EXT
+
+
+#parse lent del .obj amb pywavefront
+def parse_obj(obj_file):
+    objs = pywavefront.Wavefront(obj_file, parse=True)
+    obj = objs.materials.popitem()[1]
+    vertex_data = np.array(obj.vertices, dtype='f4')
+    return vertex_data, obj.vertex_format
+
+
+#retorna (vertex_data, vertex_format) del cache, o None si no existeix o no correspon al .obj
+def read_cache(path, digest):
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+        file_size = os.path.getsize(path)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, vertex_format, count, stride, file_digest = HEADER.unpack(header)
+    if magic != MAGIC or file_digest != digest:
+        return None
+    if file_size != HEADER_SIZE + count * stride * 4:
+        return None
+    vertex_data = np.memmap(path, dtype='<f4', mode='r', offset=HEADER_SIZE, shape=(count * stride,))
+    return vertex_data, vertex_format.rstrip(b'\0').decode('ascii')
+
+
+def write_cache(path, vertex_data, vertex_format, digest):
+    stride = sum(int(c) for c in vertex_format if c.isdigit()) #T2F_N3F_V3F -> 8 floats
+    header = HEADER.pack(MAGIC, vertex_format.encode('ascii'), len(vertex_data) // stride, stride, digest)
+    #escriure a un fitxer temporal i despres reemplacar, per no deixar mai un cache a mitges
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(header.ljust(HEADER_SIZE, b'\0'))
+        file.write(np.ascontiguousarray(vertex_data, dtype='<f4').tobytes())
+    os.replace(tmp_path, path)
+
+
+#carrega els vertexs d'un .obj: del cache si el .obj no ha canviat, sino parse i es regenera el cache
+def load_vertex_data(obj_file):
+    digest = source_hash(obj_file)
+    path = cache_path(obj_file)
+    cached = read_cache(path, digest)
+    if cached is not None:
+        return cached
+
+    vertex_data, vertex_format = parse_obj(obj_file)
+    try:
+        write_cache(path, vertex_data, vertex_format, digest)
+    except OSError as e:
+        print(f"[Warning] No s'ha pogut escriure el mesh cache {path}: {e}")
+    return vertex_data, vertex_format
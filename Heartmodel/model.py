@@ -1,61 +1,82 @@
 import glm
 import numpy as np
 import moderngl as mgl
-import pywavefront
 import pygame as pg
 
-# heart class to represent a 3D heart model
-class Heart:
-    def __init__(self, app, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1), ppm=100, mask=[1]*100):
+from mesh_cache import load_vertex_data
+from timestep import SIM_HZ
+
+#velocitat de rotacio (graus/pas) per sota de la qual el cor es considera aturat
+ROTATION_EPSILON = 1e-3
+#maxim de cors per escena: mida de l'array del uniform block Instances a default.vert (128 * 128 bytes = 16 KB)
+MAX_HEARTS = 128
+INSTANCES_BINDING = 1
+#per instancia (std140): mat4 m_model | mat3 m_normal (3 columnes de vec4) | vec4 morph
+_INSTANCE_FLOATS = 32
+_M_MODEL = 0
+_M_NORMAL = 16
+_MORPH = 28
+
+
+#renderer instanciat de tots els cors de l'escena: una malla, un programa, una textura i un sol draw
+#l'estat d'animacio de cada cor (fase, ppm, beat mask) viu en arrays i s'actualitza vectoritzat amb NumPy
+class HeartRenderer:
+    def __init__(self, app):
         self.app = app
         self.ctx = app.ctx
-        self.pos = pos
-        #treballarem amb aquest self.rot per fer les rotacions del cor
-        self.rot = glm.vec3([glm.radians(a) for a in rot])
-        self.scale = scale
-        
+        self.hearts = []
+
         #shader program
         self.program = self.get_program('default')
         #3D vertex data
         self.vertex_data = self.get_vertex_data('objects/heart/base.obj')
         #imatge texture
         self.texture = self.get_texture('objects/heart/texture_diffuse.png')
-        
+
         #Vertex Buffer Object i Vertex Array Object
         self.vbo = self.ctx.buffer(self.vertex_data)
         self.format = '2f 3f 3f'
         self.attribs = ['in_texcoord_0', 'in_normal', 'in_position']
-        self.vao = self.ctx.vertex_array(self.program, [(self.vbo, self.format, *self.attribs)])
-        
-        #model matrix i camera
-        self.m_model = self.get_model_matrix()
-        self.camera = self.app.camera
 
-        #variables per rotació del cor
-        self.rotation_velocity = glm.vec2(0.0, 0.0)  # velocitat de rotacio en x i y
-        self.rotation_friction = 0.985  #friccio per desaccelerar i parar el cor. 
-        
-        #si vols tornar a la posicio original que no vols rotar: R
-        self.return_key = pg.K_r  # LA R
+        # Animation vertex per steps: els morph targets es pugen un cop a la GPU i el blend es fa a default.vert
+        self.vbo_step1 = self.ctx.buffer(self.get_vertex_data('objects/heart/updated_abaix.obj'))
+        self.vbo_step2 = self.ctx.buffer(self.get_vertex_data('objects/heart/updated_ventricula.obj'))
+        self.vbo_step3 = self.ctx.buffer(self.get_vertex_data('objects/heart/updated_arterias.obj'))
+        #mateixes uv que el base.obj, nomes cal normal i posicio de cada target
+        self.morph_format = '2x4 3f 3f'
+        self.vao = self.ctx.vertex_array(self.program, [
+            (self.vbo, self.format, *self.attribs),
+            (self.vbo_step1, self.morph_format, 'in_normal_1', 'in_position_1'),
+            (self.vbo_step2, self.morph_format, 'in_normal_2', 'in_position_2'),
+            (self.vbo_step3, self.morph_format, 'in_normal_3', 'in_position_3'),
+        ])
 
-        # Animation vertex per steps
-        self.start_vertices = self.vertex_data
-        self.end_vertices_step1 = self.get_vertex_data('objects/heart/updated_abaix.obj')
-        self.end_vertices_step2 = self.get_vertex_data('objects/heart/updated_ventricula.obj')
-        self.end_vertices_step3 = self.get_vertex_data('objects/heart/updated_arterias.obj')
-
-        # Animation progress
-        self.animation_progress_1 = 0.0
-        self.animation_progress_2 = 0.0
-        self.animation_progress_3 = 0.0
-        self.tempo = 0
+        #instance buffer: transform i pesos del morph de cada cor
+        self.instance_data = np.zeros((MAX_HEARTS, _INSTANCE_FLOATS), dtype='f4')
+        self.instance_buffer = self.ctx.buffer(reserve=self.instance_data.nbytes, dynamic=True)
+        self.instance_buffer.bind_to_uniform_block(INSTANCES_BINDING)
+        self.instances_dirty = True
 
+        # Animation progress (una fila per cor)
+        self.progress = np.zeros((MAX_HEARTS, 3))
+        #progres del pas de simulacio anterior: el render interpola entre els dos
+        self.prev_progress = np.zeros((MAX_HEARTS, 3))
+        self.interpolating = False
+        self.tempo = np.zeros(MAX_HEARTS, dtype=np.int64)
         # Heart beat animation
-        self.ppm = ppm
-        self.beat_mask = mask
-        self.animate_heartbeat = True #animation control beating or not.
-        
-        #afegir beating sound:
+        self.ppm = np.zeros(MAX_HEARTS)
+        self.animating = np.zeros(MAX_HEARTS, dtype=bool)
+        self.beat_masks = np.zeros((MAX_HEARTS, 1))
+        self.mask_len = np.ones(MAX_HEARTS, dtype=np.int64)
+
+        #afegir beating sound (un sol cop per tots els cors). En headless no hi ha dispositiu d'audio
+        self.heartbeat_channel = None
+        if not app.headless:
+            self.load_sounds()
+
+        self.on_init()
+
+    def load_sounds(self):
         self.heartbeat_sound_slow = pg.mixer.Sound("Bateg_Cor.wav") #50 ppm
         self.heartbeat_sound_normal = pg.mixer.Sound("Bateg_Cor_normal.wav") #150 ppm
         self.heartbeat_sound_fast = pg.mixer.Sound("Bateg_Cor_fast2.wav") #250 ppm
@@ -66,19 +87,213 @@ class Heart:
         #fer servir un canal audio diferent per no juntar amb background music
         self.heartbeat_channel = pg.mixer.Channel(1)
 
-        self.on_init()
-            
-    def update_rotation(self):
+    #registrar un cor: retorna la seva fila als arrays d'instancia
+    def add(self, heart):
+        if len(self.hearts) >= MAX_HEARTS:
+            raise ValueError(f"Massa cors a l'escena (maxim {MAX_HEARTS})")
+        self.hearts.append(heart)
+        return len(self.hearts) - 1
+
+    def set_beat_mask(self, index, mask):
+        if len(mask) > self.beat_masks.shape[1]:
+            grown = np.zeros((MAX_HEARTS, len(mask)))
+            grown[:, :self.beat_masks.shape[1]] = self.beat_masks
+            self.beat_masks = grown
+        self.beat_masks[index, :len(mask)] = mask
+        self.mask_len[index] = len(mask)
+        self.tempo[index] %= len(mask)
+        self.instances_dirty = True
+
+    def set_transform(self, index, m_model, m_normal):
+        self.instance_data[index, _M_MODEL:_M_MODEL + 16] = np.frombuffer(m_model.to_bytes(), dtype='f4')
+        #std140: cada columna del mat3 ocupa un vec4
+        normal_columns = self.instance_data[index, _M_NORMAL:_M_NORMAL + 12].reshape(3, 4)
+        normal_columns[:, :3] = np.frombuffer(m_normal.to_bytes(), dtype='f4').reshape(3, 3)
+        self.instances_dirty = True
+
+    #load vertex dara de .obj file (via mesh_cache: memmap del binari si el .obj no ha canviat)
+    def get_vertex_data(self, obj_file):
+        vertex_data, vertex_format = load_vertex_data(obj_file)
+        if vertex_format != 'T2F_N3F_V3F':
+            raise ValueError(f"{obj_file}: vertex format {vertex_format}, s'esperava T2F_N3F_V3F")
+        return vertex_data
+
+    #texture per render
+    def get_texture(self, path):
+        texture = pg.image.load(path)
+        if not self.app.headless: #convert() necessita una finestra
+            texture = texture.convert()
+        texture = pg.transform.flip(texture, flip_x=False, flip_y=True)
+        texture = self.ctx.texture(size=texture.get_size(), components=3,
+                                   data=pg.image.tostring(texture, 'RGB'))
+        # mipmaps
+        texture.filter = (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR)
+        texture.build_mipmaps()
+        # AF
+        texture.anisotropy = 32.0
+        return texture
+
+    #load shader program
+    def get_program(self, shader_program_name):
+        with open(f'shaders/{shader_program_name}.vert') as file:
+            vertex_shader = file.read()
+
+        with open(f'shaders/{shader_program_name}.frag') as file:
+            fragment_shader = file.read()
+
+        program = self.ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+        return program
+
+    def on_init(self):
+        # texture (el bind el fa Scene.render via RenderState)
+        self.program['u_texture_0'] = 0
+        # mvp i light: m_proj, m_view, camPos i light venen del uniform block Frame (compartit per tots els programes)
+        self.app.frame_uniforms.bind(self.program)
+        # transform i morph de cada cor
+        self.program['Instances'].binding = INSTANCES_BINDING
+
+    #heartbeat animació de tots els cors alhora: avança el progres de cada pas (la interpolació de vertexs es fa al vertex shader)
+    #dt en segons (un pas de simulacio). factor_1 ~ 1/60: progress_1 fa un cicle per batec, ppm batecs per minut sigui quin sigui el frame rate
+    def animate(self, dt, factor_1=0.0167, factor_2=0.0067):
+        n = len(self.hearts)
+        self.prev_progress[:n] = self.progress[:n]
+        active = self.animating[:n] & (self.ppm[:n] > 0) #if beating=true animate.
+        if not active.any():
+            if self.interpolating:
+                #ultim render a alpha < 1: cal tornar a pujar els pesos ja quiets
+                self.interpolating = False
+                self.instances_dirty = True
+            return
+        step_1 = np.where(active, self.ppm[:n] * factor_1 * dt, 0.0)
+        step_2 = np.where(active, self.ppm[:n] * factor_2 * dt, 0.0)
+        progress = self.progress[:n]
+
+        progress[:, 0] += step_1
+        beat_done = active & (progress[:, 0] >= 1.0)
+        if beat_done.any():
+            progress[beat_done, 0] = 0.0
+            #el batec torna a comencar: no interpolar entre el final i l'inici
+            self.prev_progress[:n][beat_done, 0] = 0.0
+            tempo = self.tempo[:n]
+            tempo[beat_done] = (tempo[beat_done] + 1) % self.mask_len[:n][beat_done]
+            #un sol canal d'audio: sona el primer cor que acaba el batec
+            self.play_heartbeat(self.ppm[:n][beat_done][0])
+
+        #blend progressiu
+        rising_2 = progress[:, 0] >= 0.5
+        progress[:, 1] += np.where(rising_2 & (progress[:, 1] < 1.0), step_2, 0.0)
+        progress[:, 1] -= np.where(~rising_2 & (progress[:, 1] > 0.0), step_2, 0.0)
+        rising_3 = progress[:, 0] >= 0.75
+        progress[:, 2] += np.where(rising_3 & (progress[:, 2] < 1.0), step_1, 0.0)
+        progress[:, 2] -= np.where(~rising_3 & (progress[:, 2] > 0.0), step_1, 0.0)
+
+        self.interpolating = True
+        self.instances_dirty = True
+
+    def play_heartbeat(self, ppm):
+        if self.heartbeat_channel is None:
+            return
+        if not self.heartbeat_channel.get_busy():
+            if ppm >= 150: #fast
+                self.heartbeat_channel.play(self.heartbeat_sound_fast)
+            elif ppm >= 75: #normal
+                self.heartbeat_channel.play(self.heartbeat_sound_normal)
+            else: #slow
+                self.heartbeat_channel.play(self.heartbeat_sound_slow)
+
+    #pes de cada morph target per default.vert: (1 - b2 - b3) * step1 + b2 * step2 + b3 * step3, amb step_i = mix(base, target_i, progress_i * beat)
+    #alpha: interpolacio entre el progres del pas anterior i l'actual
+    def update_morph_weights(self, alpha=1.0):
+        n = len(self.hearts)
+        progress = self.prev_progress[:n] + (self.progress[:n] - self.prev_progress[:n]) * alpha
+        beat = self.beat_masks[np.arange(n), self.tempo[:n]]
+        # mix ponderada dels passos
+        blend_factor_step2 = np.minimum(progress[:, 1] * 2, 1.0)
+        blend_factor_step3 = np.minimum(progress[:, 2] * 2, 1.0)
+        blend = np.stack([1 - blend_factor_step2 - blend_factor_step3, blend_factor_step2, blend_factor_step3], axis=1)
+        self.instance_data[:n, _MORPH:_MORPH + 3] = progress * beat[:, None] * blend
+
+    #un sol draw per tots els cors i totes les vistes (instancia = cor * num_views + vista)
+    def render(self, state, num_views=1):
+        n = len(self.hearts)
+        if n == 0:
+            return
+        alpha = self.app.alpha
+        for heart in self.hearts:
+            heart.update_transform(alpha)
+        #mentre batega, cada frame cau a un punt diferent entre dos passos
+        if self.instances_dirty or self.interpolating:
+            self.update_morph_weights(alpha)
+            self.instance_buffer.write(self.instance_data[:n])
+            self.instances_dirty = False
+        state.use_texture(self.texture, 0)
+        self.vao.render(instances=n * num_views)
+
+    #netejar GPU resources
+    def destroy(self):
+        self.app.scene.render_state.forget(self.program, self.texture)
+        self.vao.release()
+        self.vbo.release()
+        self.vbo_step1.release()
+        self.vbo_step2.release()
+        self.vbo_step3.release()
+        self.instance_buffer.release()
+        self.texture.release()
+        self.program.release()
+
+
+# heart class to represent a 3D heart model
+#cada cor es una instancia del HeartRenderer: guarda el seu transform i la seva fila dels arrays d'animacio
+class Heart:
+    def __init__(self, renderer, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1), ppm=100, mask=[1]*100):
+        self.renderer = renderer
+        self.app = renderer.app
+        self.index = renderer.add(self)
+        #transform: pos, rot, scale i rotation_y marquen la model matrix com a bruta quan canvien
+        self._rotation_y = 0.0
+        self.pos = pos
+        #treballarem amb aquest self.rot per fer les rotacions del cor
+        self.rot = glm.vec3([glm.radians(a) for a in rot])
+        self.scale = scale
+
+        #model matrix, normal matrix i camera
+        self.update_transform()
+        self.camera = self.app.camera
+
+        #variables per rotació del cor
+        self.rotation_velocity = glm.vec2(0.0, 0.0)  # velocitat de rotacio en x i y
+        self.rotation_friction = 0.985  #friccio per desaccelerar i parar el cor.
+
+        #si vols tornar a la posicio original que no vols rotar: R
+        self.return_key = pg.K_r  # LA R
+
+        # Heart beat animation
+        self.ppm = ppm
+        self.beat_mask = mask
+        self.animate_heartbeat = True #animation control beating or not.
+
+    #dt en segons: velocitat (graus/pas) i friccio estan ajustades a passos de 1/60 s
+    def update_rotation(self, dt):
         #no mes control amb keyboard: y,u,i,o... ara amb gestures
         #les funcions rotate_left, right, up, down gestionen els canvis de self.rotation_velocity.y .x;  + o -. Aquesta funcio es standard per totes: friccio i actualitzar
-        
+        steps = dt * SIM_HZ
+
         # Aplicar fricció
-        self.rotation_velocity *= self.rotation_friction
-        
-        # Actualitzar rotació
-        self.rot.y += glm.radians(self.rotation_velocity.x)
-        self.rot.x += glm.radians(self.rotation_velocity.y)
-    
+        self.rotation_velocity *= self.rotation_friction ** steps
+        #per sota d'aquest valor el cor ja esta quiet: no cal tornar a calcular la model matrix
+        if glm.length(self.rotation_velocity) < ROTATION_EPSILON:
+            self.rotation_velocity = glm.vec2(0.0, 0.0)
+            if self._prev_rot != self.rot: #s'acaba d'aturar: deixar d'interpolar
+                self._prev_rot = glm.vec3(self.rot)
+                self.transform_dirty = True
+            return
+
+        # Actualitzar rotació (in place, cal marcar la matrix com a bruta)
+        self._prev_rot = glm.vec3(self.rot)
+        self.rot.y += glm.radians(self.rotation_velocity.x) * steps
+        self.rot.x += glm.radians(self.rotation_velocity.y) * steps
+        self.transform_dirty = True
+
     #funcions pels gestures canviar la rotació
     #1.1 es la rotation_speed
     def rotate_left(self): #gesture action = swipe left
@@ -92,145 +307,127 @@ class Heart:
 
     def rotate_down(self): #gesture action = swipe down
         self.rotation_velocity.y -= 1.1
-    
+
     #reset rotation a normal: tornar a pos inicial abans rotacio
     def reset_rotation(self): #gesture action = click
         self.rotation_velocity = glm.vec2(0.0, 0.0) #tornar velocitat a 0
         self.rot = glm.vec3(0, 0, 0) #tornar rotació a 0
-    
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        self._pos = value
+        self.transform_dirty = True
+
+    @property
+    def rot(self):
+        return self._rot
+
+    #assignar rot es un salt (reset): no s'interpola des de la rotacio anterior
+    @rot.setter
+    def rot(self, value):
+        self._rot = value
+        self._prev_rot = glm.vec3(value)
+        self.transform_dirty = True
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._scale = value
+        self.transform_dirty = True
+
+    #additional rotation around Y-axis
+    @property
+    def rotation_y(self):
+        return self._rotation_y
+
+    @rotation_y.setter
+    def rotation_y(self, value):
+        self._rotation_y = value
+        self.transform_dirty = True
+
+    #recalcular model i normal matrix nomes si el transform ha canviat o el cor esta girant
+    #alpha: interpolacio entre la rotacio del pas anterior i l'actual
+    def update_transform(self, alpha=1.0):
+        interpolating = self._prev_rot != self.rot
+        if self.transform_dirty or interpolating:
+            rot = glm.mix(self._prev_rot, self.rot, alpha) if interpolating else self.rot
+            self.m_model = self.get_model_matrix(rot)
+            #normal matrix un cop a la CPU en lloc de transpose(inverse(m_model)) per cada vertex
+            self.m_normal = glm.transpose(glm.inverse(glm.mat3(self.m_model)))
+            self.renderer.set_transform(self.index, self.m_model, self.m_normal)
+            self.transform_dirty = False
+
     #model transform matrix (translation, rotation, scale)
-    def get_model_matrix(self):
+    def get_model_matrix(self, rot=None):
+        rot = self.rot if rot is None else rot
         m_model = glm.mat4()
         # translate
         m_model = glm.translate(m_model, self.pos)
         # rotate
-        m_model = glm.rotate(m_model, self.rot.z, glm.vec3(0, 0, 1))
-        m_model = glm.rotate(m_model, self.rot.y, glm.vec3(0, 1, 0))
-        m_model = glm.rotate(m_model, self.rot.x, glm.vec3(1, 0, 0))
+        m_model = glm.rotate(m_model, rot.z, glm.vec3(0, 0, 1))
+        m_model = glm.rotate(m_model, rot.y, glm.vec3(0, 1, 0))
+        m_model = glm.rotate(m_model, rot.x, glm.vec3(1, 0, 0))
         #additional rotation around Y-axis
-        rotation_y = getattr(self, 'rotation_y', 0.0) 
-        m_model = glm.rotate(m_model, rotation_y, glm.vec3(0, 1, 0))
+        m_model = glm.rotate(m_model, self.rotation_y, glm.vec3(0, 1, 0))
         # scale
         m_model = glm.scale(m_model, self.scale)
         return m_model
-    
-    #load vertex dara de .obj file
-    def get_vertex_data(self, obj_file):
-        objs = pywavefront.Wavefront(obj_file, parse=True)
-        obj = objs.materials.popitem()[1]
-        vertex_data = obj.vertices
-        vertex_data = np.array(vertex_data, dtype='f4')
-        return vertex_data    
-    
-    #texture per render
-    def get_texture(self, path):
-        texture = pg.image.load(path).convert()
-        texture = pg.transform.flip(texture, flip_x=False, flip_y=True)
-        texture = self.ctx.texture(size=texture.get_size(), components=3,
-                                   data=pg.image.tostring(texture, 'RGB'))
-        # mipmaps
-        texture.filter = (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR)
-        texture.build_mipmaps()
-        # AF
-        texture.anisotropy = 32.0
-        return texture
-    
-    #load shader program
-    def get_program(self, shader_program_name):
-        with open(f'/Users/carlotacortes/Desktop/Heartmodel/shaders/{shader_program_name}.vert') as file:
-            vertex_shader = file.read()
 
-        with open(f'/Users/carlotacortes/Desktop/Heartmodel/shaders/{shader_program_name}.frag') as file:
-            fragment_shader = file.read()
+    #estat d'animacio: viu a la fila self.index dels arrays del renderer
+    @property
+    def ppm(self):
+        return self._ppm
 
-        program = self.ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
-        return program
+    @ppm.setter
+    def ppm(self, value):
+        self._ppm = value
+        self.renderer.ppm[self.index] = value
 
-    def on_init(self):
-        # texture
-        self.program['u_texture_0'] = 0
-        self.texture.use()
-        # mvp
-        self.program['m_proj'].write(self.camera.m_proj)
-        self.program['m_view'].write(self.camera.m_view)
-        self.program['m_model'].write(self.m_model)
-        # light
-        #self.program['light.position'].write(self.app.light.position)
-        self.program['light.Ia'].write(self.app.light.Ia)
-        self.program['light.Id'].write(self.app.light.Id)
-        self.program['light.Is'].write(self.app.light.Is)
+    @property
+    def beat_mask(self):
+        return self._beat_mask
+
+    @beat_mask.setter
+    def beat_mask(self, mask):
+        self._beat_mask = mask
+        self.renderer.set_beat_mask(self.index, mask)
+
+    @property
+    def animate_heartbeat(self):
+        return self._animate_heartbeat
+
+    @animate_heartbeat.setter
+    def animate_heartbeat(self, value):
+        self._animate_heartbeat = value
+        self.renderer.animating[self.index] = value
+
+    @property
+    def animation_progress_1(self):
+        return float(self.renderer.progress[self.index, 0])
+
+    @property
+    def animation_progress_2(self):
+        return float(self.renderer.progress[self.index, 1])
+
+    @property
+    def animation_progress_3(self):
+        return float(self.renderer.progress[self.index, 2])
+
+    @property
+    def tempo(self):
+        return int(self.renderer.tempo[self.index])
 
     def update_animation_params(self, ppm, mask):
         self.ppm = ppm
         self.beat_mask = mask
-    
-    #vertex updates per heartbeat animació: interpolació vertexs.
-    def update_vertex(self, factor_1=0.0167, factor_2=0.0067):
-        self.animation_progress_1 += (self.ppm * factor_1) / 60
-        if self.animation_progress_1 >= 1.0:
-             self.animation_progress_1 = 0.0
-             self.tempo += 1
-             if self.tempo == len(self.beat_mask):
-                self.tempo = 0
-             if not self.heartbeat_channel.get_busy():
-                if self.ppm >= 150: #fast
-                    self.heartbeat_channel.play(self.heartbeat_sound_fast)
-                elif self.ppm >= 75: #normal
-                    self.heartbeat_channel.play(self.heartbeat_sound_normal)
-                else: #slow
-                    self.heartbeat_channel.play(self.heartbeat_sound_slow)
-        
-        #blend progressiu
-        if self.animation_progress_1 >= 0.5:
-            if self.animation_progress_2 < 1.0:
-                self.animation_progress_2 += (self.ppm * factor_2) / 60
-        else:
-            if self.animation_progress_2 > 0.0:
-                self.animation_progress_2 -= (self.ppm * factor_2) / 60
-
-        if self.animation_progress_1 >= 0.75:
-            if self.animation_progress_3 < 1.0:
-                self.animation_progress_3 += (self.ppm * factor_1) / 60
-        else:
-            if self.animation_progress_3 > 0.0:
-                self.animation_progress_3 -= (self.ppm * factor_1) / 60
-                
-
-        # Interpolació per cada pas
-        interpolated_vertices_step1 = ((1 - self.animation_progress_1 * self.beat_mask[self.tempo]) * self.start_vertices) + (self.animation_progress_1 * self.beat_mask[self.tempo] * self.end_vertices_step1)
-        interpolated_vertices_step2 = ((1 - self.animation_progress_2 * self.beat_mask[self.tempo]) * self.start_vertices) + (self.animation_progress_2 * self.beat_mask[self.tempo] * self.end_vertices_step2)
-        interpolated_vertices_step3 = ((1 - self.animation_progress_3 * self.beat_mask[self.tempo]) * self.start_vertices) + (self.animation_progress_3 * self.beat_mask[self.tempo] * self.end_vertices_step3)
 
-        # mix ponderada dels passos
-        blend_factor_step2 = min(self.animation_progress_2 * 2, 1.0)
-        blend_factor_step3 = min(self.animation_progress_3 * 2, 1.0)  
-        p1 = (1 - blend_factor_step2 - blend_factor_step3) * interpolated_vertices_step1
-        p2 = blend_factor_step2 * interpolated_vertices_step2
-        p3 = blend_factor_step3 * interpolated_vertices_step3
-        blended_vertices = p1 + p2 + p3
-
-        # actualitzar vertexs model
-        self.vbo.write(np.array(blended_vertices, dtype='f4'))
-
-    def update(self):
-        self.texture.use()
-        self.program['camPos'].write(self.camera.position)
-        self.program['m_view'].write(self.camera.m_view)
-        self.m_model = self.get_model_matrix()  # Recalculate model matrix
-        self.program['m_model'].write(self.m_model)
-        
-    def render(self):
-        self.update()
-        self.vao.render()
-    
-    #actualitzar animacio i rotacio cada frame
-    def animate(self):
-        if self.animate_heartbeat and self.ppm > 0: #if beating=true animate.
-            self.update_vertex()
-        self.update_rotation()
-    
-    #netejar GPU resources
-    def destroy(self):
-        self.vbo.release()
-        self.texture.release()
-        self.program.release()
+    #actualitzar rotacio cada pas de simulacio (el batec l'anima HeartRenderer.animate per tots els cors alhora)
+    def animate(self, dt):
+        self.update_rotation(dt)
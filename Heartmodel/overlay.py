@@ -0,0 +1,129 @@
+import moderngl as mgl
+import numpy as np
+
+#quad unitari que es col·loca a la pantalla amb el uniform rect (no cal geometria nova per moure'l o escalar-lo)
+OVERLAY_VERTEX_SHADER = '''
+    #version 330
+    in vec2 in_corner;
+    uniform vec4 rect; // x0, y0, x1, y1 en coordenades NDC
+    uniform bool flip_y; // frames d'OpenCV: la primera fila es la de dalt
+    out vec2 v_text;
+    void main() {
+        gl_Position = vec4(mix(rect.xy, rect.zw, in_corner), 0.0, 1.0);
+        v_text = flip_y ? vec2(in_corner.x, 1.0 - in_corner.y) : in_corner;
+    }
+'''
+
+OVERLAY_FRAGMENT_SHADER = '''
+    #version 330
+    uniform sampler2D overlay_tex;
+    uniform float opacity;
+    uniform bool swizzle_bgr; // frames d'OpenCV en BGR
+    in vec2 v_text;
+    out vec4 f_color;
+    void main() {
+        vec4 color = texture(overlay_tex, v_text);
+        if (swizzle_bgr) {
+            color.rgb = color.bgr;
+        }
+        f_color = vec4(color.rgb, color.a * opacity);
+    }
+'''
+
+
+#una capa de l'overlay: textura + posicio a la pantalla
+#bgr i flip_y per pujar frames d'OpenCV tal qual i fer la conversio al shader
+class OverlayLayer:
+    def __init__(self, rect, texture=None, opacity=1.0, bgr=False, flip_y=False):
+        self.rect = rect
+        self.texture = texture
+        self.opacity = opacity
+        self.bgr = bgr
+        self.flip_y = flip_y
+        self.visible = True
+
+
+#textura que es refresca cada frame (webcam) a traves de pixel buffers en rotacio
+#cada frame s'escriu a un PBO diferent i la textura es puja del PBO omplert el frame anterior:
+#la copia d'aquell PBO ja ha acabat, aixi la pujada no espera la d'aquest frame (a canvi d'un frame de retard)
+class StreamingTexture:
+    def __init__(self, ctx, size, components=3, buffers=3):
+        self.size = size
+        self.texture = ctx.texture(size, components=components)
+        self.texture.repeat_x = False
+        self.texture.repeat_y = False
+        self.texture.filter = (mgl.LINEAR, mgl.LINEAR)
+        frame_bytes = size[0] * size[1] * components
+        self.pbos = [ctx.buffer(reserve=frame_bytes, dynamic=True) for _ in range(buffers)]
+        self.index = 0
+        self.filled = False
+
+    #frame: np.ndarray (h, w, components) uint8. Es puja amb el buffer protocol, sense tobytes()
+    def write(self, frame):
+        self.pbos[self.index].write(np.ascontiguousarray(frame))
+        #el primer frame no te PBO anterior i es puja directament
+        previous = self.index - 1 if self.filled else self.index
+        self.texture.write(self.pbos[previous])
+        self.filled = True
+        self.index = (self.index + 1) % len(self.pbos)
+
+    def release(self):
+        for pbo in self.pbos:
+            pbo.release()
+        self.texture.release()
+
+
+#texture unit propi: la unit 0 es de l'escena i RenderState la dona per bindada entre frames
+OVERLAY_TEXTURE_UNIT = 1
+
+
+#compositor de capes 2D per sobre de l'escena (webcam picture-in-picture, panells de debug...)
+#el programa, el VBO i el VAO es creen un sol cop i es reutilitzen a cada frame
+class Overlay:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.program = ctx.program(vertex_shader=OVERLAY_VERTEX_SHADER, fragment_shader=OVERLAY_FRAGMENT_SHADER)
+        self.program['overlay_tex'] = OVERLAY_TEXTURE_UNIT
+        corners = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 1.0, 1.0], dtype='f4')
+        self.vbo = ctx.buffer(corners)
+        self.vao = ctx.vertex_array(self.program, [(self.vbo, '2f', 'in_corner')])
+        #les capes es dibuixen en ordre d'insercio
+        self.layers = {}
+
+    def add_layer(self, name, rect, texture=None, opacity=1.0, bgr=False, flip_y=False):
+        layer = OverlayLayer(rect, texture, opacity, bgr, flip_y)
+        self.layers[name] = layer
+        return layer
+
+    def set_texture(self, name, texture):
+        self.layers[name].texture = texture
+
+    #moure o redimensionar una capa: nomes canvia el uniform
+    def set_rect(self, name, rect):
+        self.layers[name].rect = rect
+
+    #mida en pixels d'una capa dins d'una finestra win_size
+    def layer_size(self, name, win_size):
+        x0, y0, x1, y1 = self.layers[name].rect
+        return int(abs(x1 - x0) * win_size[0] / 2), int(abs(y1 - y0) * win_size[1] / 2)
+
+    def render(self):
+        self.ctx.disable(mgl.DEPTH_TEST)
+        self.ctx.enable(mgl.BLEND)
+        for layer in self.layers.values():
+            if not layer.visible or layer.texture is None:
+                continue
+            self.program['rect'] = layer.rect
+            self.program['opacity'] = layer.opacity
+            self.program['swizzle_bgr'] = layer.bgr
+            self.program['flip_y'] = layer.flip_y
+            layer.texture.use(location=OVERLAY_TEXTURE_UNIT)
+            self.vao.render(mgl.TRIANGLE_STRIP)
+        self.ctx.disable(mgl.BLEND)
+        self.ctx.enable(mgl.DEPTH_TEST)
+
+    #netejar GPU resources
+    def release(self):
+        self.vao.release()
+        self.vbo.release()
+        self.program.release()
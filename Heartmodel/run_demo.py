@@ -6,9 +6,12 @@ import numpy as np
 import cv2
 import pygame
 
+from dynamic_gestures.idle_scheduler import IdleScheduler
 from dynamic_gestures.main_controller import MainController
+from dynamic_gestures.onnx_models import MODEL_VARIANTS, SessionConfig
+from dynamic_gestures.pipeline import PipelinedController
 from dynamic_gestures.utils.drawer import Drawer
-from dynamic_gestures.utils import Event
+from dynamic_gestures.utils import Event, FrameGrabber
 
 from main import GraphicsEngine #no need to import model or camera, as they are part of the GraphicsEngine
 from gesture_action_mapper import GestureActionMapper
@@ -24,25 +27,34 @@ def init_music(music_file = "Eerie_Carlota.mp3"): #inner_peace
         print(f"[Warning] No s'ha pogut iniciar background music")
 
 def gesture_loop(args, gesture_mapper):
-    #initialize webcam
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    #initialize webcam: captura en un thread propi, cada iteracio agafa el frame mes nou (girat) i descarta els vells
+    grabber = FrameGrabber(0, 1280, 720, flip=True).start()
     
     #initialized the gesture detection system
-    controller = MainController(args.detector, args.classifier)
+    controller = MainController(
+        args.detector,
+        args.classifier,
+        session_config=SessionConfig.from_args(args),
+        model_variant=args.model_variant,
+        detection_interval=args.detection_interval,
+        max_label_reuse=args.max_label_reuse,
+    )
+    #detection, classification and tracking as pipeline stages on worker threads, frames still come out in order
+    #no detection on a static empty scene, and a lower capture rate after --idle-after seconds without activity
+    idle_scheduler = IdleScheduler(args.idle_after, args.idle_fps) if args.idle_after > 0 else None
+    pipeline = PipelinedController(controller, grabber, threaded=args.pipelined, idle_scheduler=idle_scheduler).start()
     drawer = Drawer()
     debug_mode = args.debug
+    last_result = time.time()
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        frame = cv2.flip(frame, 1)
+    while pipeline.is_running():
+        #bounding boxes for detected gestures, unique IDs for tracked hands and gesture labels
+        ret, frame, bboxes, ids, labels = pipeline.read()
         if not ret:
             break
-
-        start_time = time.time()
-        #bounding boxes for detected gestures, unique IDs for tracked hands and gesture labels
-        bboxes, ids, labels = controller(frame)
+        now = time.time()
+        fps = 1.0 / max(now - last_result, 1e-6)
+        last_result = now
 
         if debug_mode:
             if bboxes is not None:
@@ -53,22 +65,30 @@ def gesture_loop(args, gesture_mapper):
                     cv2.putText(frame, f"ID {ids[i]} : {gesture_name}", (box[0], box[1] - 10),
                                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
             #show FPS
-            fps = 1.0 / (time.time() - start_time)
             cv2.putText(frame, f"fps {fps:.2f}", (10, 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            #temps des de la captura fins al resultat i frames descartats
+            stats = pipeline.stats()
+            cv2.putText(frame, f"latency {stats['result_latency_ms']:.0f} ms, dropped {stats['dropped']}", (10, 60),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
         
-        #GESTURE ACTIONS
-        if len(controller.tracks) > 0:
+        #GESTURE ACTIONS: el thread de tracking pot estar actualitzant el frame seguent
+        #sota el lock nomes es recullen les mans i les accions, el dispatch i el dibuix es fan fora
+        with controller.lock:
+            tracks = [(trk["tracker"].time_since_update, trk["hands"][-1:], trk["hands"].action) for trk in controller.tracks]
+            for trk in controller.tracks:
+                if trk["tracker"].time_since_update < 1 and len(trk["hands"]):
+                    trk["hands"].action = None
+        if len(tracks) > 0:
             count_of_zoom = 0
             thumb_boxes = []
 
-            for trk in controller.tracks:
+            for time_since_update, hands, action in tracks:
                 #if track has a new update
-                if trk["tracker"].time_since_update < 1 and len(trk["hands"]):
-                    hand = trk["hands"][-1]
+                if time_since_update < 1 and len(hands):
+                    hand = hands[-1]
 
-                    if trk["hands"].action is not None:
-                        action = trk["hands"].action
+                    if action is not None:
                         
                         tinicial = time.time() #start the timer before habdling gesture
                         
@@ -110,8 +130,6 @@ def gesture_loop(args, gesture_mapper):
                         #stop timer
                         elapsed = time.time() - tinicial
                         print(f"{action} took {elapsed:.3f}s")
-                        
-                        trk["hands"].action = None
 
                     if hand.gesture == 3: #Assuming this is a zoom-hand state
                         count_of_zoom += 1
@@ -129,7 +147,10 @@ def gesture_loop(args, gesture_mapper):
         if cv2.waitKey(1) & 0xFF == ord("c"):
             break
 
-    cap.release()
+    pipeline.stop()
+    print(f"Capture stats: {pipeline.stats()}")
+    if controller.classification_cache is not None:
+        print(f"Classification cache: {controller.classification_cache.stats()}")
     cv2.destroyAllWindows()
 
 
@@ -139,7 +160,7 @@ def run(args):
     
     # Start HeartModel rendering engine
     ## first create the app (GraphicsEngine in main.py, that has the camera, scene,...)
-    app = GraphicsEngine()
+    app = GraphicsEngine(max_fps=args.max_fps)
     #a bridge between gestures and action on the 3Dmodel
     gesture_mapper = GestureActionMapper(
         camera=app.camera,
@@ -165,6 +186,33 @@ if __name__ == "__main__":
     parser.add_argument("--detector", default="dynamic_gestures/models/hand_detector.onnx", type=str)
     parser.add_argument("--classifier", default="dynamic_gestures/models/crops_classifier.onnx", type=str)
     parser.add_argument("--debug", required=False, action="store_true", help="Enable debug drawing")
+    parser.add_argument("--max-fps", default=60, type=int, help="Render rate cap (animation speed does not depend on it)")
+    parser.add_argument(
+        "--model-variant", default="float", choices=MODEL_VARIANTS, help="int8: quantized models (dynamic_gestures.quantize)"
+    )
+    parser.add_argument(
+        "--detection-interval",
+        default=1,
+        type=int,
+        help="Maximum frames between full detections, the tracker predicts the hands in between",
+    )
+    parser.add_argument(
+        "--max-label-reuse",
+        default=0,
+        type=int,
+        help="Frames a hand whose crop barely changed may reuse its label before it is classified again",
+    )
+    parser.add_argument(
+        "--idle-after",
+        default=0,
+        type=float,
+        help="Seconds without motion or hands before the capture rate drops to --idle-fps, 0 disables motion gating",
+    )
+    parser.add_argument("--idle-fps", default=5, type=float, help="Capture and detection rate while idle")
+    parser.add_argument(
+        "--pipelined", action="store_true", help="Run detection, classification and tracking as overlapping pipeline stages"
+    )
+    SessionConfig.add_arguments(parser)
 
     args = parser.parse_args()
     run(args)
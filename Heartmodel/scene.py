@@ -1,32 +1,69 @@
 from model import *
 import random
 
+#estat de GL ja aplicat per l'escena: evita binds de textura i writes de uniforms que no han canviat
+#els programes guarden els seus uniforms entre frames, aixi que l'estat es conserva d'un frame a l'altre
+class RenderState:
+    def __init__(self):
+        self.textures = {} #texture unit -> textura
+        self.uniforms = {} #(program, nom) -> bytes escrits
+
+    def use_texture(self, texture, location=0):
+        if self.textures.get(location) is not texture:
+            texture.use(location=location)
+            self.textures[location] = texture
+
+    #value: tipus glm (mat4, vec3...)
+    def write_uniform(self, program, name, value):
+        data = value.to_bytes()
+        key = (program, name)
+        if self.uniforms.get(key) != data:
+            program[name].write(data)
+            self.uniforms[key] = data
+
+    #oblidar un programa o textura alliberats
+    def forget(self, program=None, texture=None):
+        self.uniforms = {key: data for key, data in self.uniforms.items() if key[0] is not program}
+        self.textures = {location: tex for location, tex in self.textures.items() if tex is not texture}
+
+
 #Defines the scene class which manages and renders 3D objects == the Heart is the first.
 class Scene:
     def __init__(self, app, models_data):
         self.app = app
         self.objects = [] #all objects in scene
+        self.render_state = RenderState()
+        self.draw_queue = [] #renderers instanciats, ordenats per programa i textura
+        #tots els cors comparteixen malla, programa i textura: un sol draw
+        self.heart_renderer = self.add_renderer(HeartRenderer(app))
         self.load(models_data) #load initial objects
 
+    #add a renderer (dibuixa tots els objectes d'un tipus)
+    def add_renderer(self, renderer):
+        self.draw_queue.append(renderer)
+        self.draw_queue.sort(key=lambda renderer: (id(renderer.program), id(renderer.texture)))
+        return renderer
+
     #add a single object
     def add_object(self, obj):
         self.objects.append(obj)
     
     #load objects from models_data: app, pos, rot, scale, ppm, mask
     def load(self, models_data):
-        app = self.app
         add = self.add_object
         for data in models_data:
             pos, rot, scale, ppm, mask = data[0], data[1], data[2], data[3], data[4], 
-            add(Heart(app, pos, rot, scale, ppm, mask))
+            add(Heart(self.heart_renderer, pos, rot, scale, ppm, mask))
     
-    #render objects
-    def render(self):
-        for obj in self.objects:
-            obj.render()
+    #render objects (un draw per renderer per a tots els seus objectes i totes les vistes)
+    def render(self, num_views=1):
+        for renderer in self.draw_queue:
+            renderer.render(self.render_state, num_views)
     
-    #animate objects
-    def animate(self):
+    #animate objects un pas de simulacio de dt segons (batec vectoritzat al renderer, rotacio per objecte)
+    def animate(self, dt):
+        for renderer in self.draw_queue:
+            renderer.animate(dt)
         for obj in self.objects:
-            obj.animate()
+            obj.animate(dt)
          
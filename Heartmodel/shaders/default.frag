@@ -5,6 +5,7 @@ layout (location = 0) out vec4 fragColor;
 in vec2 uv_0;
 in vec3 normal;
 in vec3 fragPos;
+flat in vec3 camPos;
 
 struct Light {
     vec3 position;
@@ -13,9 +14,17 @@ struct Light {
     vec3 Is;
 };
 
-uniform Light light;
+// mateix block que default.vert
+layout (std140) uniform Frame {
+    mat4 m_proj;
+    mat4 m_view[4];
+    vec4 camPositions[4];
+    vec4 tiles[4];
+    int num_views;
+    Light light;
+};
+
 uniform sampler2D u_texture_0;
-uniform vec3 camPos;
 
 
 vec3 getLight(vec3 color) {
@@ -3,19 +3,69 @@
 layout (location = 0) in vec2 in_texcoord_0;
 layout (location = 1) in vec3 in_normal;
 layout (location = 2) in vec3 in_position;
+// morph targets: updated_abaix, updated_ventricula, updated_arterias
+layout (location = 3) in vec3 in_normal_1;
+layout (location = 4) in vec3 in_position_1;
+layout (location = 5) in vec3 in_normal_2;
+layout (location = 6) in vec3 in_position_2;
+layout (location = 7) in vec3 in_normal_3;
+layout (location = 8) in vec3 in_position_3;
 
 out vec2 uv_0;
 out vec3 normal;
 out vec3 fragPos;
+flat out vec3 camPos;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
-uniform mat4 m_model;
+struct Light {
+    vec3 position;
+    vec3 Ia;
+    vec3 Id;
+    vec3 Is;
+};
+
+// camera i llum del frame (uniforms.py): cada instancia es dibuixa amb una vista i al seu tile
+layout (std140) uniform Frame {
+    mat4 m_proj;
+    mat4 m_view[4];
+    vec4 camPositions[4];
+    vec4 tiles[4];
+    int num_views;
+    Light light;
+};
+
+// un element per cor (model.py: HeartRenderer)
+struct Instance {
+    mat4 m_model;
+    mat3 m_normal;
+    vec4 morph; // xyz: pes de cada morph target
+};
+
+layout (std140) uniform Instances {
+    Instance instances[128];
+};
 
 
 void main() {
+    // instancia = cor * num_views + vista
+    Instance instance = instances[gl_InstanceID / num_views];
+    int view = gl_InstanceID % num_views;
+    mat4 m_model = instance.m_model;
+
+    vec3 w = instance.morph.xyz;
+    vec3 position = in_position + w.x * (in_position_1 - in_position) + w.y * (in_position_2 - in_position) + w.z * (in_position_3 - in_position);
+    vec3 morphNormal = in_normal + w.x * (in_normal_1 - in_normal) + w.y * (in_normal_2 - in_normal) + w.z * (in_normal_3 - in_normal);
+
     uv_0 = in_texcoord_0;
-    fragPos = vec3(m_model * vec4(in_position, 1.0));
-    normal = mat3(transpose(inverse(m_model))) * normalize(in_normal);
-    gl_Position = m_proj * m_view * m_model * vec4(in_position, 1.0);
-}
\ No newline at end of file
+    fragPos = vec3(m_model * vec4(position, 1.0));
+    normal = instance.m_normal * normalize(morphNormal);
+    camPos = camPositions[view].xyz;
+
+    vec4 clipPos = m_proj * m_view[view] * vec4(fragPos, 1.0);
+    // retallar al frustum de la vista i despres portar-la al seu tile de la pantalla
+    gl_ClipDistance[0] = clipPos.w + clipPos.x;
+    gl_ClipDistance[1] = clipPos.w - clipPos.x;
+    gl_ClipDistance[2] = clipPos.w + clipPos.y;
+    gl_ClipDistance[3] = clipPos.w - clipPos.y;
+    vec4 tile = tiles[view];
+    gl_Position = vec4(clipPos.xy * tile.zw + tile.xy * clipPos.w, clipPos.zw);
+}
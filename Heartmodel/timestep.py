@@ -0,0 +1,26 @@
+#simulacio a pas fix, independent del frame rate del render
+#les constants d'animacio i de friccio (ppm * factor / 60, rotation_friction, zoom_friction, impulsos dels gestures)
+#es van ajustar per frame a 60 fps: ara son per pas de simulacio, i un pas sempre dura 1/60 s
+SIM_HZ = 60
+SIM_DT = 1.0 / SIM_HZ
+#maxim de passos per frame: si el render es queda penjat (carregar models, gesture thread...) la simulacio
+#perd aquest temps en lloc d'encadenar passos cada cop mes llargs
+MAX_STEPS = 5
+
+
+#acumula el temps real de cada frame i diu quants passos fixos cal simular
+#alpha: fraccio del seguent pas que ja ha passat, per interpolar entre l'estat anterior i l'actual al render
+class FixedTimestep:
+    def __init__(self, dt=SIM_DT, max_steps=MAX_STEPS):
+        self.dt = dt
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.alpha = 1.0
+
+    #frame_time en segons. Retorna el nombre de passos a simular aquest frame
+    def advance(self, frame_time):
+        self.accumulator = min(self.accumulator + frame_time, self.max_steps * self.dt)
+        steps = int(self.accumulator / self.dt)
+        self.accumulator -= steps * self.dt
+        self.alpha = self.accumulator / self.dt
+        return steps
@@ -0,0 +1,67 @@
+import numpy as np
+
+#uniform block 'Frame' compartit per tots els programes de l'escena (default.vert/.frag)
+#std140: mat4 m_proj | mat4 m_view[4] | vec4 camPositions[4] | vec4 tiles[4] | int num_views | Light light
+MAX_VIEWS = 4
+FRAME_BINDING = 0
+_M_PROJ = 0
+_M_VIEW = 16
+_CAM_POS = _M_VIEW + 16 * MAX_VIEWS
+_TILES = _CAM_POS + 4 * MAX_VIEWS
+_NUM_VIEWS = _TILES + 4 * MAX_VIEWS
+_LIGHT = _NUM_VIEWS + 4 #struct Light: position, Ia, Id, Is (cada vec3 ocupa 16 bytes)
+_SIZE = _LIGHT + 16 #floats
+
+#tile de cada vista en NDC: (offset x, offset y, escala x, escala y)
+FULL_TILE = (0.0, 0.0, 1.0, 1.0)
+TOP_LEFT_TILE = (-0.5, 0.5, 0.5, 0.5)
+BOTTOM_LEFT_TILE = (-0.5, -0.5, 0.5, 0.5)
+BOTTOM_RIGHT_TILE = (0.5, -0.5, 0.5, 0.5)
+TOP_RIGHT_TILE = (0.5, 0.5, 0.5, 0.5)
+
+GL_CLIP_DISTANCE0 = 0x3000
+
+
+#dades de camera i llum del frame en un sol uniform buffer, s'escriu un cop per frame i el comparteixen tots els programes
+#cada objecte es dibuixa un cop amb instancing: la instancia tria la vista i el tile de la pantalla
+class FrameUniforms:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.data = np.zeros(_SIZE, dtype='f4')
+        self.buffer = ctx.buffer(reserve=self.data.nbytes, dynamic=True)
+        self.buffer.bind_to_uniform_block(FRAME_BINDING)
+        self.num_views = 0
+
+    #connectar el uniform block d'un programa a aquest buffer
+    def bind(self, program):
+        program['Frame'].binding = FRAME_BINDING
+
+    #intensitats de la llum (nomes cal quan canvien)
+    #light.position no s'ha enviat mai als shaders (estava comentat a on_init): es queda a l'origen com fins ara
+    def write_light(self, light):
+        for i, intensity in enumerate((light.Ia, light.Id, light.Is)):
+            self.data[_LIGHT + 4 * (i + 1):_LIGHT + 4 * (i + 1) + 3] = np.frombuffer(intensity.to_bytes(), dtype='f4')
+        self.buffer.write(self.data)
+
+    #views: llista de (m_view, camera position, tile)
+    def write_views(self, m_proj, views):
+        self.num_views = len(views)
+        self.data[_M_PROJ:_M_PROJ + 16] = np.frombuffer(m_proj.to_bytes(), dtype='f4')
+        for i, (m_view, position, tile) in enumerate(views):
+            self.data[_M_VIEW + 16 * i:_M_VIEW + 16 * (i + 1)] = np.frombuffer(m_view.to_bytes(), dtype='f4')
+            self.data[_CAM_POS + 4 * i:_CAM_POS + 4 * i + 3] = np.frombuffer(position.to_bytes(), dtype='f4')
+            self.data[_TILES + 4 * i:_TILES + 4 * (i + 1)] = tile
+        self.data[_NUM_VIEWS:_NUM_VIEWS + 1].view('i4')[0] = self.num_views
+        self.buffer.write(self.data)
+
+    #el shader retalla cada instancia al seu tile amb gl_ClipDistance[0..3]
+    def enable_clipping(self):
+        for i in range(4):
+            self.ctx.enable_direct(GL_CLIP_DISTANCE0 + i)
+
+    def disable_clipping(self):
+        for i in range(4):
+            self.ctx.disable_direct(GL_CLIP_DISTANCE0 + i)
+
+    def release(self):
+        self.buffer.release()